@@ -1,25 +1,63 @@
-from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
 
+import asyncio
+import hashlib
+import json
 import shutil
+import time
 import uuid
 import os
 
-from bedrock_report import generate_bedrock_report
+from contextlib import asynccontextmanager
+
 # from llm_vision_report import generate_vision_report
 # from llm_report import generate_llm_report
-from image_diff import compare_images
-from object_detect import detect_objects
-from object_compare import compare_objects
-from comparison_builder import build_comparison_json
+from image_diff import decode_image
+from artifacts import ARTIFACT_WAIT_S
+from caching import artifact_pending
+from pipeline import (
+    run_inspection, build_result_payload, shutdown_pools, warmup, preload_models,
+    defer_report, pending_report, finish_report, stream_report, register_static,
+    UnreadableImage
+)
+from job_queue import JobQueue, QueueFull
+from baseline_store import (
+    get_baseline_store, valid_asset_id, UnknownAsset, BASELINE_URL_PREFIX
+)
+from timing import StageTimer, server_timing, profile_if_slow, PROFILE_SLOW_MS
+import metrics
 # from summary_ai import generate_summary
 
 load_dotenv()
 
-app = FastAPI()
+# result.html is sent with the CV results; the report streams in (SSE)
+REPORT_STREAMING = os.getenv("REPORT_STREAMING", "1") == "1"
+
+
+# load YOLO at import so preforked workers share it (gunicorn --preload)
+if os.getenv("PRELOAD_MODELS", "0") == "1":
+    preload_models()
+
+jobs = JobQueue()
+metrics.JOB_QUEUE_DEPTH.set_function(jobs.depth)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if os.getenv("WARMUP_MODELS", "1") == "1":
+        await warmup()
+    await jobs.start()
+    yield
+    await jobs.stop()
+    shutdown_pools()
+
+
+app = FastAPI(lifespan=lifespan)
 
 templates = Jinja2Templates(directory="templates")
 
@@ -27,8 +65,106 @@ templates = Jinja2Templates(directory="templates")
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("outputs", exist_ok=True)
 
-app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
+baselines = get_baseline_store()
+
+class PendingStaticFiles(StaticFiles):
+    """
+    Artifacts are written in the background after the response is
+    sent; a fetch that arrives first waits briefly for the file
+    (as long as its write is still pending).
+    """
+
+    async def get_response(self, path, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404 or not path.endswith(".jpg"):
+                raise
+
+        full_path = os.path.join(self.directory, path)
+        deadline = time.monotonic() + ARTIFACT_WAIT_S
+        while (not os.path.exists(full_path) and artifact_pending(full_path)
+               and time.monotonic() < deadline):
+            await asyncio.sleep(0.05)
+
+        return await super().get_response(path, scope)
+
+
+class ImageStaticFiles(PendingStaticFiles):
+    """Only .jpg files; the baseline pickles / metadata stay private"""
+
+    async def get_response(self, path, scope):
+        if not path.endswith(".jpg"):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+
+app.mount("/outputs", PendingStaticFiles(directory="outputs"), name="outputs")
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount(
+    BASELINE_URL_PREFIX, ImageStaticFiles(directory=baselines.directory), name="baselines"
+)
+# result pages link artifacts through these mounts
+register_static("outputs", "/outputs")
+register_static("uploads", "/uploads")
+register_static(baselines.directory, BASELINE_URL_PREFIX)
+
+
+# static files and the scrape itself are not counted
+UNMETERED_PREFIXES = ("/outputs/", "/uploads/", "/baselines/", "/metrics")
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if request.url.path.startswith(UNMETERED_PREFIXES):
+        return await call_next(request)
+
+    metrics.IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.IN_FLIGHT.dec()
+        # route template, so /jobs/<id> does not explode the label set
+        route = request.scope.get("route")
+        route = route.path if route is not None else "unmatched"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - start, route=route)
+        metrics.HTTP_REQUESTS.inc(route=route, status=status)
+
+
+# opt-in: dump a sampled profile of requests slower than PROFILE_SLOW_MS
+if PROFILE_SLOW_MS:
+    @app.middleware("http")
+    async def profile_slow_requests(request: Request, call_next):
+        with profile_if_slow(f"{request.method}_{request.url.path}"):
+            return await call_next(request)
+
+
+async def render_result(request, inspection, before_path, after_path, out_path):
+    if REPORT_STREAMING:
+        await defer_report(inspection)
+
+    context = build_result_payload(inspection, before_path, after_path, out_path)
+    context["request"] = request
+
+    response = templates.TemplateResponse("result.html", context)
+    response.headers["Server-Timing"] = server_timing(inspection["timings"])
+    return response
+
+
+def write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def save_upload(upload):
+    path = f"uploads/{uuid.uuid4()}.jpg"
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.file, f)
+    return path
 
 
 # ================= HOME =================
@@ -50,75 +186,204 @@ async def analyze(
     after: UploadFile = File(...)
 ):
 
-    # ---------- save uploads ----------
+    timer = StageTimer()
+
+    # ---------- read uploads (decoded once, only on a cache miss) ----------
+    before_bytes = await before.read()
+    after_bytes = await after.read()
+
+    # ---------- persist originals off the critical path ----------
     before_path = f"uploads/{uuid.uuid4()}.jpg"
     after_path = f"uploads/{uuid.uuid4()}.jpg"
 
-    with open(before_path, "wb") as f:
-        shutil.copyfileobj(before.file, f)
+    persist = asyncio.gather(
+        asyncio.to_thread(write_bytes, before_path, before_bytes),
+        asyncio.to_thread(write_bytes, after_path, after_bytes)
+    )
+
+    # ---------- run pipeline ----------
+    out_path = f"outputs/{uuid.uuid4()}.jpg"
+
+    digests = (
+        hashlib.sha256(before_bytes).hexdigest(),
+        hashlib.sha256(after_bytes).hexdigest()
+    )
+
+    try:
+        inspection = await run_inspection(
+            before_bytes, after_bytes, out_path, digests, timer=timer,
+            report=not REPORT_STREAMING
+        )
+    except UnreadableImage as e:
+        await persist
+        for path in (before_path, after_path):
+            os.remove(path)
+        return HTMLResponse(str(e), status_code=400)
+    await persist
+
+    # ---------- render UI ----------
+    return await render_result(request, inspection, before_path, after_path, out_path)
+
+
+# ================= REPORT STREAM (SSE) =================
 
-    with open(after_path, "wb") as f:
-        shutil.copyfileobj(after.file, f)
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # ---------- run comparison ----------
+
+@app.get("/reports/{report_id}/stream")
+async def report_stream(report_id: str):
+    comparison_json = await asyncio.to_thread(pending_report, report_id)
+    if comparison_json is None:
+        return JSONResponse({"detail": "Unknown or expired report"}, status_code=404)
+
+    async def events():
+        try:
+            async for text in stream_report(comparison_json):
+                yield sse("chunk", text)
+            # streamed and cached: the parked comparison is not needed
+            await asyncio.to_thread(finish_report, report_id)
+            yield sse("done", {})
+        except Exception as e:
+            yield sse("failed", {"detail": f"Report could not be generated: {type(e).__name__}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # no caching / proxy buffering, so chunks reach the page as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ================= METRICS =================
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# ================= JOBS =================
+
+def queue_full_response():
+    return JSONResponse(
+        {"detail": "Job queue is full, retry later"},
+        status_code=503,
+        headers={"Retry-After": "5"}
+    )
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    before: UploadFile = File(...),
+    after: UploadFile = File(...)
+):
+    if await asyncio.to_thread(jobs.depth) >= jobs.max_pending:
+        return queue_full_response()
+
+    before_path = await asyncio.to_thread(save_upload, before)
+    after_path = await asyncio.to_thread(save_upload, after)
     out_path = f"outputs/{uuid.uuid4()}.jpg"
 
-    result = compare_images(before_path, after_path, out_path)
+    try:
+        job = await jobs.submit(before_path, after_path, out_path)
+    except QueueFull:
+        return queue_full_response()
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"detail": "Job not found"}, status_code=404)
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error"],
+        # same payload result.html is rendered from
+        "result": job["result"],
+    }
+
 
-    # ---------- object detection layer ----------
-    before_objs = detect_objects(before_path)
-    after_objs = detect_objects(after_path)
+# ================= ASSET BASELINES =================
 
-    added, removed = compare_objects(before_objs, after_objs)
+@app.post("/assets/{asset_id}/baseline")
+async def register_baseline(asset_id: str, image: UploadFile = File(...)):
+    if not valid_asset_id(asset_id):
+        return JSONResponse({"detail": "Invalid asset id"}, status_code=400)
 
-    # =====================================================
-    # ✅ BUILD FINAL STRUCTURED COMPARISON JSON (PUT HERE)
-    # =====================================================
-    comparison_json = build_comparison_json(
-        result,
-        before_objs,
-        after_objs,
-        added,
-        removed
+    data = await image.read()
+
+    try:
+        meta = await asyncio.to_thread(baselines.register, asset_id, data)
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+
+    return meta
+
+
+@app.get("/assets/{asset_id}/baseline")
+def get_baseline(asset_id: str):
+    if not valid_asset_id(asset_id):
+        return JSONResponse({"detail": "Invalid asset id"}, status_code=400)
+
+    meta = baselines.meta(asset_id)
+    if meta is None:
+        return JSONResponse({"detail": "No baseline for this asset"}, status_code=404)
+    return meta
+
+
+@app.post("/assets/{asset_id}/inspect", response_class=HTMLResponse)
+async def inspect_asset(
+    request: Request,
+    asset_id: str,
+    after: UploadFile = File(...),
+    camera_position: str = Form("default")
+):
+    if not valid_asset_id(asset_id):
+        return HTMLResponse("Invalid asset id", status_code=400)
+
+    try:
+        baseline = await asyncio.to_thread(baselines.load, asset_id)
+    except UnknownAsset:
+        return HTMLResponse("No baseline registered for this asset", status_code=404)
+
+    timer = StageTimer()
+
+    # ---------- only the "after" image is uploaded ----------
+    after_bytes = await after.read()
+    after_img = await asyncio.to_thread(
+        timer.call, "decode_after", decode_image, after_bytes
     )
 
-    # ---------- AI summary ----------
-    # vision_summary = generate_vision_report(before_path, after_path)
-    bedrock_report = generate_bedrock_report(comparison_json)
+    if after_img is None:
+        return HTMLResponse("The image could not be read", status_code=400)
 
-    # ---------- render UI ----------
-    return templates.TemplateResponse(
-        "result.html",
-        {
-            "request": request,
-
-            # core metrics
-            "metrics": result,
-
-            # structured comparison (for AI / logs / export)
-            "comparison_json": comparison_json,
-
-            # objects
-            "before_objs": before_objs,
-            "after_objs": after_objs,
-            "added": added,
-            "removed": removed,
-
-            # originals for slider
-            "before_original": "/" + before_path,
-            "after_original": "/" + after_path,
-
-            # AI report
-            # "vision_summary": vision_summary,
-            "bedrock_report": bedrock_report,
-
-            # images
-            "output_image": "/" + out_path,
-            "heatmap_image": "/" + result["heatmap_path"],
-            "before_heatmap_image": "/" + result["before_heatmap_path"],
-
-            # interactive zones
-            "zone_boxes": result.get("zone_boxes", {}),
-            "zone_severity": result.get("zone_severity", {}),
-        }
-    )
\ No newline at end of file
+    after_path = f"uploads/{uuid.uuid4()}.jpg"
+    persist = asyncio.create_task(
+        asyncio.to_thread(write_bytes, after_path, after_bytes)
+    )
+
+    # ---------- run pipeline against the stored baseline ----------
+    out_path = f"outputs/{uuid.uuid4()}.jpg"
+    digests = (baseline["digest"], hashlib.sha256(after_bytes).hexdigest())
+
+    inspection = await run_inspection(
+        baseline["image"], after_img, out_path, digests,
+        homography_key=f"{asset_id}:{camera_position}",
+        timer=timer,
+        report=not REPORT_STREAMING
+    )
+    await persist
+
+    return await render_result(
+        request, inspection, baseline["meta"]["reference_path"], after_path, out_path
+    )
@@ -0,0 +1,122 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from caching import PENDING_SUFFIX
+
+
+# =========================================================
+# CONFIG
+# =========================================================
+# "background": encode + write on a small thread pool, compare_images
+#               returns as soon as the paths are known
+# "sync":       write before returning (original behaviour)
+ARTIFACT_WRITE_MODE = os.getenv("ARTIFACT_WRITE_MODE", "background")
+ARTIFACT_WRITERS = int(os.getenv("ARTIFACT_WRITERS", 2))
+
+# 95 is what cv2.imwrite used before
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", 95))
+
+ALL_ARTIFACTS = ("annotated", "heatmap", "before_heatmap", "diff_mask", "comparison")
+
+# which images compare_images produces at all (comma separated)
+ARTIFACTS = tuple(
+    a.strip()
+    for a in os.getenv("ARTIFACTS", ",".join(ALL_ARTIFACTS)).split(",")
+    if a.strip()
+)
+
+# how long a static fetch waits for an artifact still being written
+ARTIFACT_WAIT_S = float(os.getenv("ARTIFACT_WAIT_S", 10))
+
+_writer = None
+_writer_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def wants(name):
+    """Is this artifact enabled?"""
+    return name in ARTIFACTS
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(
+                max_workers=ARTIFACT_WRITERS, thread_name_prefix="artifact-writer"
+            )
+    return _writer
+
+
+def _encode_and_write(path, img, quality):
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError(f"JPEG encoding failed for {path}")
+
+    # readers never see a half-written file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def write_jpeg(path, img, quality=None):
+    """
+    Write an artifact image. In background mode this returns right
+    away; the array must not be modified afterwards.
+    """
+    quality = JPEG_QUALITY if quality is None else quality
+
+    if ARTIFACT_WRITE_MODE != "background":
+        return _encode_and_write(path, img, quality)
+
+    # result caches in other processes treat the path as present
+    # until the marker goes away (see caching.artifact_pending)
+    with open(path + PENDING_SUFFIX, "wb"):
+        pass
+
+    fut = _get_writer().submit(_encode_and_write, path, img, quality)
+    with _pending_lock:
+        _pending.add(fut)
+    fut.add_done_callback(lambda f: _done(path, f))
+    return path
+
+
+def _done(path, fut):
+    with _pending_lock:
+        _pending.discard(fut)
+
+    # a failed write leaves neither the file nor the marker, so cached
+    # results that reference it are dropped on their next lookup and
+    # static fetches stop waiting for it
+    try:
+        os.remove(path + PENDING_SUFFIX)
+    except OSError:
+        pass
+    if fut.exception() is not None:
+        print(f"Warning: artifact write failed: {fut.exception()}")
+
+
+def flush(timeout=None):
+    """Block until every queued artifact is on disk"""
+    with _pending_lock:
+        pending = list(_pending)
+    for fut in pending:
+        fut.exception(timeout=timeout)
+
+
+def _reset_after_fork():
+    # the writer threads do not exist in a forked child
+    global _writer, _writer_lock, _pending_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+    _pending_lock = threading.Lock()
+    _pending.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
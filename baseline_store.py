@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+
+from caching import LRUCache, get_feature_cache
+from image_diff import (
+    decode_image, normalize_size, analyze_reference, reference_cache_key, engine_params
+)
+from object_detect import get_batcher
+from pipeline import cached_objects, store_objects
+
+
+# =========================================================
+# CONFIG
+# =========================================================
+BASELINE_DIR = os.getenv("BASELINE_DIR", "baselines")
+# where app.py mounts BASELINE_DIR (any filesystem location)
+BASELINE_URL_PREFIX = "/baselines"
+
+ASSET_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class UnknownAsset(Exception):
+    """No baseline registered for this asset id"""
+
+
+def valid_asset_id(asset_id):
+    return bool(ASSET_ID_RE.match(asset_id)) and asset_id not in (".", "..")
+
+
+def _write_atomic(path, data):
+    # load() may read while a re-registration writes: never in place
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# =========================================================
+# ASSET REGISTRY
+# baselines/<asset_id>/
+#   reference.jpg          original upload (as received)
+#   heatmap.jpg            structure heatmap of the reference
+#   baseline.pkl           normalized image + precomputed features
+#                          (+ the engine_params they were computed with)
+#   meta.json              registration info
+# =========================================================
+class BaselineStore:
+
+    def __init__(self, directory=BASELINE_DIR, max_loaded=32):
+        self.directory = directory
+        self.loaded = LRUCache(max_loaded)
+        os.makedirs(directory, exist_ok=True)
+
+    def _dir(self, asset_id):
+        if not valid_asset_id(asset_id):
+            raise ValueError(f"Invalid asset id: {asset_id!r}")
+        return os.path.join(self.directory, asset_id)
+
+    @staticmethod
+    def url(asset_id, name):
+        """Public URL of a file in an asset's directory"""
+        return f"{BASELINE_URL_PREFIX}/{asset_id}/{name}"
+
+    @staticmethod
+    def _write_baseline(asset_dir, baseline):
+        _write_atomic(
+            os.path.join(asset_dir, "baseline.pkl"),
+            pickle.dumps(baseline, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+    def register(self, asset_id, data):
+        """
+        Store a reference image for an asset and precompute everything
+        an inspection needs from it (blocking; run off the event loop).
+        """
+        asset_dir = self._dir(asset_id)
+
+        img = decode_image(data)
+        if img is None:
+            raise ValueError("Reference image could not be read")
+
+        os.makedirs(asset_dir, exist_ok=True)
+        digest = hashlib.sha256(data).hexdigest()
+
+        reference_path = os.path.join(asset_dir, "reference.jpg")
+        _write_atomic(reference_path, data)
+
+        # engine working size + per-image features
+        normalized = normalize_size(img)
+        features = analyze_reference(
+            normalized, os.path.join(asset_dir, "heatmap.jpg")
+        )
+
+        # detections go through the shared inference thread
+        objects = cached_objects(digest)
+        if objects is None:
+            objects = get_batcher().submit(img).result()
+
+        self._write_baseline(asset_dir, {
+            "digest": digest,
+            "image": normalized,
+            "features": features,
+            "objects": objects,
+            "engine_params": engine_params(),
+        })
+
+        meta = {
+            "asset_id": asset_id,
+            "digest": digest,
+            "registered_at": time.time(),
+            "reference_path": reference_path,
+            "reference_url": self.url(asset_id, "reference.jpg"),
+            "width": int(normalized.shape[1]),
+            "height": int(normalized.shape[0]),
+            "objects": objects,
+        }
+        _write_atomic(
+            os.path.join(asset_dir, "meta.json"),
+            json.dumps(meta, indent=2).encode()
+        )
+
+        self.loaded.pop(asset_id)
+        self._seed_caches(digest, features, objects)
+        return meta
+
+    def meta(self, asset_id):
+        path = os.path.join(self._dir(asset_id), "meta.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def load(self, asset_id):
+        """
+        Baseline for an inspection: {"meta", "digest", "image", ...}.
+        The precomputed features are pushed into the feature cache so
+        compare_images picks them up instead of recomputing.
+        """
+        baseline = self.loaded.get(asset_id)
+
+        if baseline is None:
+            meta = self.meta(asset_id)
+            if meta is None:
+                raise UnknownAsset(asset_id)
+
+            asset_dir = self._dir(asset_id)
+            with open(os.path.join(asset_dir, "baseline.pkl"), "rb") as f:
+                baseline = pickle.load(f)
+
+            # features from another engine configuration (pyramid level,
+            # thresholds, version) must not be seeded under the current key
+            if baseline.get("engine_params") != engine_params():
+                baseline["features"] = analyze_reference(
+                    baseline["image"], os.path.join(asset_dir, "heatmap.jpg")
+                )
+                baseline["engine_params"] = engine_params()
+                self._write_baseline(asset_dir, baseline)
+
+            baseline["meta"] = meta
+            self.loaded.put(asset_id, baseline)
+
+        self._seed_caches(
+            baseline["digest"], baseline["features"], baseline["objects"]
+        )
+        return baseline
+
+    @staticmethod
+    def _seed_caches(digest, features, objects):
+        cache = get_feature_cache()
+        key = reference_cache_key(digest)
+        if cache.get(key) is None:
+            cache.put(key, features)
+        if cached_objects(digest) is None:
+            store_objects(digest, objects)
+
+
+_store = None
+
+
+def get_baseline_store():
+    global _store
+    if _store is None:
+        _store = BaselineStore()
+    return _store
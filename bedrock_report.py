@@ -1,18 +1,186 @@
-import boto3
+import asyncio
+import io
 import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import as_completed
 
-#Create Bedrock Runtime Client
-bedrock = boto3.client(
-    service_name = "bedrock-runtime",
-    region_name = "us-east-1"
+from caching import LRUCache, DiskCache, content_hash
+import metrics
+import prompt_encoding
+from prompt_encoding import (
+    encode_comparison, record_usage, estimate_tokens, compact_comparison, dumps_compact
 )
 
+_client = None
+_client_lock = threading.Lock()
+
+# bump whenever the prompt / request body changes (invalidates the cache)
+PROMPT_VERSION = 2
+
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", 7 * 24 * 3600))
+REPORT_CACHE_ENTRIES = int(os.getenv("REPORT_CACHE_ENTRIES", 1024))
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "cache/reports")
+REPORT_CACHE_MAX_MB = float(os.getenv("REPORT_CACHE_MAX_MB", 64))
+
+# batch reports: inspections packed into one request
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", 8))
+REPORT_BATCH_MAX_TOKENS = int(os.getenv("REPORT_BATCH_MAX_TOKENS", 4096))
+
+# BEDROCK_STUB=1 answers locally (offline development / tests)
+BEDROCK_STUB = os.getenv("BEDROCK_STUB", "0") == "1"
+
+# connection pool / timeouts of the boto3 client
+BEDROCK_POOL_SIZE = int(os.getenv("BEDROCK_POOL_SIZE", 10))
+BEDROCK_CONNECT_TIMEOUT = float(os.getenv("BEDROCK_CONNECT_TIMEOUT", 5))
+BEDROCK_READ_TIMEOUT = float(os.getenv("BEDROCK_READ_TIMEOUT", 60))
+
+# async layer: per-attempt timeout, concurrent calls, retries
+BEDROCK_CALL_TIMEOUT = float(os.getenv("BEDROCK_CALL_TIMEOUT", 75))
+BEDROCK_MAX_CONCURRENCY = int(os.getenv("BEDROCK_MAX_CONCURRENCY", 4))
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", 4))
+BEDROCK_BACKOFF_BASE = float(os.getenv("BEDROCK_BACKOFF_BASE", 0.5))
+BEDROCK_BACKOFF_MAX = float(os.getenv("BEDROCK_BACKOFF_MAX", 8))
+
+RETRYABLE_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+}
+RETRYABLE_ERRORS = {
+    "ReadTimeoutError",
+    "ConnectTimeoutError",
+    "EndpointConnectionError",
+    "TimeoutError",
+}
+
+
+# =========================================================
+# CLIENT (lazy; a stub can be injected)
+# =========================================================
+class StubClientError(Exception):
+    """Shaped like botocore's ClientError (e.response["Error"]["Code"])"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code, "Message": code}}
+
+
+class StubBedrockClient:
+    """
+    Stands in for the bedrock-runtime client: same invoke_model
+    signature, canned answer, records the calls it received.
+    The first fail_times calls raise error_code (e.g. throttling).
+    Batch prompts get a JSON reply; batch_drop ids are left out of
+    it to exercise the per-inspection fallback.
+    """
+
+    def __init__(self, text="Stub inspection report.", delay=0.0,
+                 fail_times=0, error_code="ThrottlingException", batch_drop=0):
+        self.text = text
+        self.delay = delay
+        self.fail_times = fail_times
+        self.error_code = error_code
+        self.batch_drop = batch_drop
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _call(self, modelId, body):
+        body = json.loads(body)
+        with self.lock:
+            self.calls.append({"modelId": modelId, "body": body})
+            fail = len(self.calls) <= self.fail_times
+        if fail:
+            raise StubClientError(self.error_code)
+
+        # estimated, the stub has no tokenizer
+        return {
+            "input_tokens": estimate_tokens(body["messages"][0]["content"]),
+            "output_tokens": estimate_tokens(self.text),
+        }
+
+    def invoke_model(self, modelId, body, **kwargs):
+        usage = self._call(modelId, body)
+        if self.delay:
+            time.sleep(self.delay)
+
+        text = self.text
+        prompt = json.loads(body)["messages"][0]["content"]
+        if BATCH_MARKER in prompt:
+            items = json.loads(prompt.split(BATCH_MARKER, 1)[1].splitlines()[0])
+            text = json.dumps({"reports": [
+                {"id": item["id"], "report": self.text}
+                for item in items[self.batch_drop:]
+            ]})
+
+        payload = {"content": [{"type": "text", "text": text}], "usage": usage}
+        return {"body": io.BytesIO(json.dumps(payload).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        usage = self._call(modelId, body)
+        words = self.text.split(" ")
+
+        def events():
+            start = {"type": "message_start",
+                     "message": {"usage": {"input_tokens": usage["input_tokens"]}}}
+            yield {"chunk": {"bytes": json.dumps(start).encode()}}
+            # delay spread over the chunks, like a real token stream
+            for i, word in enumerate(words):
+                if self.delay:
+                    time.sleep(self.delay / len(words))
+                delta = {"type": "text_delta", "text": word if i == 0 else " " + word}
+                data = {"type": "content_block_delta", "index": 0, "delta": delta}
+                yield {"chunk": {"bytes": json.dumps(data).encode()}}
+            end = {"type": "message_delta",
+                   "usage": {"output_tokens": usage["output_tokens"]}}
+            yield {"chunk": {"bytes": json.dumps(end).encode()}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_stop"}).encode()}}
+
+        return {"body": events()}
+
+
+def get_client():
+    """Create the Bedrock Runtime client on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if BEDROCK_STUB:
+                    _client = StubBedrockClient()
+                else:
+                    import boto3
+                    from botocore.config import Config
+
+                    # retries are ours (jittered, async-aware), not botocore's
+                    _client = boto3.client(
+                        service_name = "bedrock-runtime",
+                        region_name = "us-east-1",
+                        config=Config(
+                            max_pool_connections=BEDROCK_POOL_SIZE,
+                            connect_timeout=BEDROCK_CONNECT_TIMEOUT,
+                            read_timeout=BEDROCK_READ_TIMEOUT,
+                            retries={"total_max_attempts": 1},
+                        )
+                    )
+    return _client
+
+
+def set_client(client):
+    """Inject a client (e.g. StubBedrockClient); None resets to lazy boto3"""
+    global _client
+    with _client_lock:
+        _client = client
+
+
 MODEL_ID = "arn:aws:bedrock:us-east-1:778272866661:inference-profile/global.anthropic.claude-sonnet-4-20250514-v1:0"
 
-def generate_bedrock_report(comparison_json):
-    structured_data = json.dumps(comparison_json, indent=2)
-    
-    prompt = f"""
+def _render_prompt(structured_data):
+    return f"""
         You are a senior industrial inspection engineer.
 
         Below is structured before-after inspection data in JSON format:
@@ -32,9 +200,16 @@ def generate_bedrock_report(comparison_json):
         - Be concise and factual
         """
 
+
+def _build_prompt(comparison_json):
+    """Prompt with the comparison data encoded to fit the token budget"""
+    return encode_comparison(comparison_json, _render_prompt)
+
+
+def _request_body(prompt, max_tokens=500):
     body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 500,
+        "max_tokens": max_tokens,
         "temperature": 0.2,
         "messages": [
             {
@@ -43,15 +218,559 @@ def generate_bedrock_report(comparison_json):
             }
         ]
     }
+    return json.dumps(body)
+
+
+def _invoke(comparison_json):
+    prompt, info = _build_prompt(comparison_json)
+    start = time.perf_counter()
 
-    response = bedrock.invoke_model(
+    response = get_client().invoke_model(
         modelId=MODEL_ID,
-        body=json.dumps(body)
+        body=_request_body(prompt)
     )
 
     result = json.loads(response["body"].read())
+    record_usage(info, result.get("usage"), time.perf_counter() - start)
     return result["content"][0]["text"]
 
+
+def _stream_chunks(comparison_json):
+    """Blocking generator of text deltas (response streaming API)"""
+    prompt, info = _build_prompt(comparison_json)
+    start = time.perf_counter()
+
+    response = get_client().invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        body=_request_body(prompt)
+    )
+
+    usage = {}
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        data = json.loads(chunk["bytes"])
+        kind = data.get("type")
+
+        if kind == "content_block_delta":
+            text = data.get("delta", {}).get("text")
+            if text:
+                yield text
+        elif kind == "message_start":
+            usage.update(data.get("message", {}).get("usage", {}))
+        elif kind == "message_delta":
+            usage.update(data.get("usage", {}))
+
+    record_usage(info, usage or None, time.perf_counter() - start)
+
+
+# =========================================================
+# RETRIES (full jitter exponential backoff)
+# =========================================================
+def _retryable(e):
+    code = getattr(e, "response", {}).get("Error", {}).get("Code")
+    if code in RETRYABLE_CODES:
+        return True
+    return isinstance(e, (asyncio.TimeoutError, TimeoutError)) or any(
+        cls.__name__ in RETRYABLE_ERRORS for cls in type(e).__mro__
+    )
+
+
+def _backoff(attempt):
+    return random.uniform(0, min(BEDROCK_BACKOFF_MAX, BEDROCK_BACKOFF_BASE * 2 ** attempt))
+
+
+def _with_retries(fn, *args):
+    """Blocking call with the same retry policy as the async layer"""
+    for attempt in range(BEDROCK_MAX_ATTEMPTS):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if not _retryable(e) or attempt == BEDROCK_MAX_ATTEMPTS - 1:
+                raise
+            metrics.BEDROCK_RETRIES.inc()
+            time.sleep(_backoff(attempt))
+
+
+def _invoke_with_retries(comparison_json):
+    return _with_retries(_invoke, comparison_json)
+
+
+# =========================================================
+# ASYNC LAYER
+# boto3 is blocking, so calls run on a dedicated thread pool sized
+# like the connection pool; the event loop only awaits them.
+# =========================================================
+_executor = None
+_semaphore = None
+
+
+def _get_executor():
+    global _executor
+    with _client_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=BEDROCK_POOL_SIZE, thread_name_prefix="bedrock"
+            )
+    return _executor
+
+
+def _get_semaphore():
+    # created on first use inside the running loop
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(BEDROCK_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def _ainvoke_with_retries(comparison_json):
+    loop = asyncio.get_running_loop()
+
+    for attempt in range(BEDROCK_MAX_ATTEMPTS):
+        try:
+            async with _get_semaphore():
+                return await asyncio.wait_for(
+                    loop.run_in_executor(_get_executor(), _invoke, comparison_json),
+                    timeout=BEDROCK_CALL_TIMEOUT
+                )
+        except Exception as e:
+            if not _retryable(e) or attempt == BEDROCK_MAX_ATTEMPTS - 1:
+                raise
+            metrics.BEDROCK_RETRIES.inc()
+        # back off outside the semaphore so others can proceed
+        await asyncio.sleep(_backoff(attempt))
+
+
+def _pump(comparison_json, loop, queue, stop):
+    """Executor side of a stream: forward deltas into the loop's queue"""
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # loop already closed
+            stop.set()
+
+    try:
+        for text in _stream_chunks(comparison_json):
+            if stop.is_set():
+                return
+            put(("chunk", text))
+        put(("done", None))
+    except Exception as e:
+        put(("error", e))
+
+
+async def _astream_with_retries(comparison_json):
+    """
+    Async iterator of text deltas. Retries only before the first
+    delta (a half-delivered report cannot be restarted); every wait
+    for the next delta is bounded by BEDROCK_CALL_TIMEOUT.
+    A concurrency slot is held per attempt until Bedrock starts
+    answering, never across a yield or a backoff.
+    """
+    loop = asyncio.get_running_loop()
+
+    for attempt in range(BEDROCK_MAX_ATTEMPTS):
+        queue = asyncio.Queue()
+        stop = threading.Event()
+
+        started = False
+        try:
+            async with _get_semaphore():
+                loop.run_in_executor(
+                    _get_executor(), _pump, comparison_json, loop, queue, stop
+                )
+                kind, value = await asyncio.wait_for(
+                    queue.get(), timeout=BEDROCK_CALL_TIMEOUT
+                )
+
+            while True:
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                started = True
+                yield value
+                kind, value = await asyncio.wait_for(
+                    queue.get(), timeout=BEDROCK_CALL_TIMEOUT
+                )
+        except Exception as e:
+            if started or not _retryable(e) or attempt == BEDROCK_MAX_ATTEMPTS - 1:
+                raise
+            metrics.BEDROCK_RETRIES.inc()
+        finally:
+            # client went away / failed: stop reading the Bedrock stream
+            stop.set()
+
+        await asyncio.sleep(_backoff(attempt))
+
+
+def shutdown_executor():
+    global _executor
+    with _client_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+# =========================================================
+# REPORT CACHE + IN-FLIGHT COALESCING
+# comparison_json is deterministic for a pair, so is the report
+# =========================================================
+class ReportCache:
+
+    def __init__(self, ttl=REPORT_CACHE_TTL, max_entries=REPORT_CACHE_ENTRIES,
+                 directory=REPORT_CACHE_DIR, max_mb=REPORT_CACHE_MAX_MB):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, ttl=ttl)
+        self.disk = DiskCache(directory, max_mb * 1024 * 1024) if directory else None
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.ainflight = {}
+
+    @staticmethod
+    def key(comparison_json, mode="single"):
+        # content_hash sorts dict keys; the object lists come from set()s,
+        # so their order differs between processes and is sorted here.
+        # mode: "single" or "batch" -- the batch prompt asks for a different
+        # reply, so its reports are never served to single-report callers
+        canonical = dict(comparison_json)
+        canonical["objects"] = {
+            k: sorted(v) for k, v in comparison_json.get("objects", {}).items()
+        }
+        return content_hash(
+            MODEL_ID, PROMPT_VERSION, prompt_encoding.settings(), mode, canonical
+        )
+
+    def get(self, key):
+        report = self.memory.get(key)
+        if report is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None and time.time() - entry["created_at"] <= self.ttl:
+                report = entry["report"]
+                self.memory.put(key, report)
+        return report
+
+    def put(self, key, report):
+        self.memory.put(key, report)
+        if self.disk is not None:
+            self.disk.put(key, {"report": report, "created_at": time.time()})
+
+    async def aget_or_call(self, key, coro_fn, *args):
+        """get_or_call for coroutines (coalesces within the event loop)"""
+        report = self.memory.get(key)
+        if report is None and self.disk is not None:
+            report = await asyncio.to_thread(self.get, key)
+        if report is not None:
+            metrics.CACHE_REQUESTS.inc(cache="report", result="hit")
+            return report
+
+        task = self.ainflight.get(key)
+        if task is not None:
+            metrics.CACHE_REQUESTS.inc(cache="report", result="coalesced")
+            # shield: one waiter giving up must not cancel the shared call
+            return await asyncio.shield(task)
+
+        metrics.CACHE_REQUESTS.inc(cache="report", result="miss")
+
+        async def run():
+            try:
+                report = await coro_fn(*args)
+                await asyncio.to_thread(self.put, key, report)
+                return report
+            finally:
+                self.ainflight.pop(key, None)
+
+        task = self.ainflight[key] = asyncio.ensure_future(run())
+        return await asyncio.shield(task)
+
+    def get_or_call(self, key, fn, *args):
+        """
+        Cached report, or one call to fn shared by every concurrent
+        caller with the same key. Errors reach all waiters and are
+        not cached.
+        """
+        report = self.get(key)
+        if report is not None:
+            metrics.CACHE_REQUESTS.inc(cache="report", result="hit")
+            return report
+
+        with self.lock:
+            fut = self.inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self.inflight[key] = Future()
+
+        if not leader:
+            metrics.CACHE_REQUESTS.inc(cache="report", result="coalesced")
+            return fut.result()
+
+        metrics.CACHE_REQUESTS.inc(cache="report", result="miss")
+        try:
+            report = fn(*args)
+            self.put(key, report)
+            fut.set_result(report)
+            return report
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+
+_report_cache = None
+_report_cache_lock = threading.Lock()
+
+
+def get_report_cache():
+    global _report_cache
+    with _report_cache_lock:
+        if _report_cache is None:
+            _report_cache = ReportCache()
+    return _report_cache
+
+
+def generate_bedrock_report(comparison_json):
+    """Blocking version (serial pipeline, scripts)"""
+    cache = get_report_cache()
+    return cache.get_or_call(
+        cache.key(comparison_json), _invoke_with_retries, comparison_json
+    )
+
+
+async def stream_report_async(comparison_json):
+    """
+    Report as an async iterator of text pieces (for SSE).
+    A cached report, or one already being generated by another
+    request, arrives as a single piece; otherwise Bedrock's response
+    stream is relayed and the full text is cached at the end.
+    The stream is read by a task registered in cache.ainflight, so
+    concurrent requests for the same comparison share it (and it
+    finishes even if this client goes away).
+    """
+    cache = get_report_cache()
+    key = cache.key(comparison_json)
+
+    report = cache.memory.get(key)
+    if report is None and cache.disk is not None:
+        report = await asyncio.to_thread(cache.get, key)
+    if report is not None:
+        metrics.CACHE_REQUESTS.inc(cache="report", result="hit")
+        yield report
+        return
+
+    task = cache.ainflight.get(key)
+    if task is not None:
+        metrics.CACHE_REQUESTS.inc(cache="report", result="coalesced")
+        yield await asyncio.shield(task)
+        return
+
+    metrics.CACHE_REQUESTS.inc(cache="report", result="miss")
+    pieces = asyncio.Queue()
+
+    async def produce():
+        parts = []
+        try:
+            async for text in _astream_with_retries(comparison_json):
+                parts.append(text)
+                pieces.put_nowait(text)
+            report = "".join(parts)
+            await asyncio.to_thread(cache.put, key, report)
+            return report
+        finally:
+            pieces.put_nowait(None)
+            cache.ainflight.pop(key, None)
+
+    task = cache.ainflight[key] = asyncio.ensure_future(produce())
+    # nobody may be left to await a failure (client gone)
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    while True:
+        text = await pieces.get()
+        if text is None:
+            break
+        yield text
+
+    # re-raise the producer's error, if any
+    await task
+
+
+async def generate_report_async(comparison_json):
+    """
+    Report without blocking the event loop: cached / coalesced,
+    at most BEDROCK_MAX_CONCURRENCY calls in flight, each attempt
+    bounded by BEDROCK_CALL_TIMEOUT, throttling retried with jitter.
+    """
+    cache = get_report_cache()
+    return await cache.aget_or_call(
+        cache.key(comparison_json), _ainvoke_with_retries, comparison_json
+    )
+
+
+# =========================================================
+# BATCH REPORTS
+# Several inspections packed into one request; the model answers
+# with JSON keyed by inspection id. Anything missing or unparseable
+# falls back to the single-report path.
+# =========================================================
+BATCH_MARKER = "INSPECTIONS_JSON: "
+
+
+def _render_batch_prompt(items_json, count):
+    return f"""
+        You are a senior industrial inspection engineer.
+
+        Below are {count} independent before-after inspections, each with an
+        "id" and its structured inspection data in JSON format:
+
+        {BATCH_MARKER}{items_json}
+
+        Generate a professional inspection report for EACH inspection.
+
+        Requirements per report:
+        - Max 1 words
+        - Mention rust change clearly
+        - Mention affected zones
+        - State overall condition (Improved / Degraded / Stable)
+        - Include risk level (Low / Medium / High)
+        - Provide maintenance recommendation
+        - Do NOT invent values
+        - Be concise and factual
+
+        Output format - STRICT:
+        Return ONLY a JSON object, nothing else:
+        {{"reports": [{{"id": "<id>", "report": "<report text>"}}]}}
+        with exactly one entry per inspection id.
+        """
+
+
+def _parse_batch_reply(text, ids):
+    """{id: report} for every well-formed entry of the model's reply"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+
+    reports = {}
+    for item in data.get("reports", []) if isinstance(data, dict) else []:
+        if not isinstance(item, dict):
+            continue
+        report = item.get("report")
+        if item.get("id") in ids and isinstance(report, str) and report.strip():
+            reports[item["id"]] = report.strip()
+    return reports
+
+
+def _invoke_batch(comparison_jsons):
+    """One request for several inspections -> {index: report} (partial ok)"""
+    ids = [f"i{i}" for i in range(len(comparison_jsons))]
+    items = [
+        {"id": item_id, "data": compact_comparison(cj)}
+        for item_id, cj in zip(ids, comparison_jsons)
+    ]
+    prompt = _render_batch_prompt(dumps_compact(items), len(items))
+    info = {
+        "format": "batch",
+        "items": len(items),
+        "estimated_tokens": estimate_tokens(prompt),
+    }
+
+    start = time.perf_counter()
+    response = get_client().invoke_model(
+        modelId=MODEL_ID,
+        body=_request_body(
+            prompt, min(REPORT_BATCH_MAX_TOKENS, 500 * len(items))
+        )
+    )
+    result = json.loads(response["body"].read())
+    record_usage(info, result.get("usage"), time.perf_counter() - start)
+
+    reports = _parse_batch_reply(result["content"][0]["text"], set(ids))
+    return {ids.index(item_id): report for item_id, report in reports.items()}
+
+
+def _report_batch_chunk(cache, keys, comparison_jsons):
+    """
+    Results for one packed request, falling back per inspection.
+    keys are the "batch" cache keys; fallbacks are single reports and
+    are cached under the single key.
+    """
+    results = [None] * len(comparison_jsons)
+
+    try:
+        reports = _with_retries(_invoke_batch, comparison_jsons)
+    except Exception as e:
+        print(f"Warning: batch report request failed ({type(e).__name__}), "
+              f"falling back to single reports")
+        reports = {}
+
+    for i, (key, cj) in enumerate(zip(keys, comparison_jsons)):
+        if i in reports:
+            cache.put(key, reports[i])
+            results[i] = {"report": reports[i], "source": "batch", "error": None}
+            continue
+
+        try:
+            report = cache.get_or_call(cache.key(cj), _invoke_with_retries, cj)
+            results[i] = {"report": report, "source": "single", "error": None}
+        except Exception as e:
+            metrics.BEDROCK_ERRORS.inc()
+            results[i] = {
+                "report": None, "source": "failed", "error": f"{type(e).__name__}: {e}"
+            }
+
+    return results
+
+
+def generate_bedrock_reports_batch(comparison_jsons, batch_size=REPORT_BATCH_SIZE,
+                                   concurrency=BEDROCK_MAX_CONCURRENCY):
+    """
+    Reports for many inspections (blocking; batch runs).
+    Cached reports are reused, the rest are packed batch_size per
+    request with up to `concurrency` requests in flight.
+    Returns one {"report", "source", "error"} per input, in order;
+    source is "cache", "batch", "single" (fallback) or "failed".
+    A cached single report also answers a batch lookup (not vice versa).
+    """
+    cache = get_report_cache()
+    keys = [cache.key(cj, mode="batch") for cj in comparison_jsons]
+    results = [None] * len(comparison_jsons)
+
+    todo = []
+    for i, (key, cj) in enumerate(zip(keys, comparison_jsons)):
+        report = cache.get(key)
+        if report is None:
+            report = cache.get(cache.key(cj))
+        metrics.CACHE_REQUESTS.inc(
+            cache="report", result="hit" if report is not None else "miss"
+        )
+        if report is not None:
+            results[i] = {"report": report, "source": "cache", "error": None}
+        else:
+            todo.append(i)
+
+    chunks = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(
+                _report_batch_chunk, cache,
+                [keys[i] for i in chunk], [comparison_jsons[i] for i in chunk]
+            ): chunk
+            for chunk in chunks
+        }
+        for fut in as_completed(futures):
+            for i, item in zip(futures[fut], fut.result()):
+                results[i] = item
+
+    return results
+
+
 # import boto3
 
 # b = boto3.client("bedrock-runtime", region_name="ap-south-1")
@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+# =========================================================
+# CONFIG
+# =========================================================
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", 256))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "cache/results")
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", 256))
+
+FEATURE_CACHE_ENTRIES = int(os.getenv("FEATURE_CACHE_ENTRIES", 64))
+FEATURE_CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", "cache/features")
+FEATURE_CACHE_MAX_MB = float(os.getenv("FEATURE_CACHE_MAX_MB", 512))
+
+
+# =========================================================
+# HASHING
+# =========================================================
+def content_hash(*parts):
+    """
+    sha256 over several parts (bytes, str or JSON-able values).
+    Parts are length-prefixed so ("ab", "c") != ("a", "bc").
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = json.dumps(part, sort_keys=True, separators=(",", ":")).encode()
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# =========================================================
+# IN-MEMORY LRU (optionally with TTL)
+# =========================================================
+class LRUCache:
+
+    def __init__(self, max_entries=128, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+
+            value, stored_at = item
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self.data[key]
+                return default
+
+            self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic())
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def __len__(self):
+        return len(self.data)
+
+
+# =========================================================
+# ON-DISK STORE (size-bounded, LRU by mtime)
+# "json" for plain results, "pickle" for numpy-bearing values
+# The size is tracked per put; the directory is only scanned when the
+# bound is crossed (evicting down to EVICT_TO of it) or every
+# RESCAN_EVERY puts, to pick up other processes' writes.
+# =========================================================
+class DiskCache:
+
+    EVICT_TO = 0.9
+    RESCAN_EVERY = 512
+
+    def __init__(self, directory, max_bytes, codec="json"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self.suffix = ".json" if codec == "json" else ".pkl"
+        self.lock = threading.Lock()
+        self.total = None
+        self.puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.codec == "json":
+                with open(path) as f:
+                    value = json.load(f)
+            else:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+    def put(self, key, value):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if self.codec == "json":
+            with open(tmp, "w") as f:
+                json.dump(value, f)
+        else:
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        delta = self._size(tmp) - self._size(path)
+        os.replace(tmp, path)
+
+        with self.lock:
+            self.puts += 1
+            rescan = self.total is None or self.puts % self.RESCAN_EVERY == 0
+            if not rescan:
+                self.total += delta
+                rescan = self.total > self.max_bytes
+        if rescan:
+            self._evict()
+
+    def delete(self, key):
+        path = self._path(key)
+        size = self._size(path)
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            if self.total is not None:
+                self.total -= size
+
+    def _evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    # evicted by another process meanwhile
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+            if total > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_bytes * self.EVICT_TO:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        pass
+
+            self.total = total
+
+
+# =========================================================
+# COMPARE_IMAGES RESULT CACHE
+# =========================================================
+# result keys that point at files under outputs/
+ARTIFACT_KEYS = (
+    "annotated_path",
+    "heatmap_path",
+    "before_heatmap_path",
+    "diff_mask_path",
+    "comparison_path",
+)
+
+# artifacts.write_jpeg marks a background write with "<path>.pending"
+# (visible to every process) until it succeeded or failed
+PENDING_SUFFIX = ".pending"
+# a marker older than this is left over from a crashed writer
+PENDING_MAX_AGE_S = float(os.getenv("ARTIFACT_WAIT_S", 10))
+
+
+def artifact_pending(path):
+    """Is a background write of this artifact still in progress?"""
+    try:
+        age = time.time() - os.stat(path + PENDING_SUFFIX).st_mtime
+    except OSError:
+        return False
+    return age < PENDING_MAX_AGE_S
+
+
+class ResultCache:
+    """
+    Content-addressed cache of compare_images results.
+    Key = hash(before bytes, after bytes, engine params); the value is
+    the result dict, whose artifact paths must still exist on disk.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_ENTRIES,
+                 directory=RESULT_CACHE_DIR, max_mb=RESULT_CACHE_MAX_MB):
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskCache(directory, max_mb * 1024 * 1024) if directory else None
+
+    @staticmethod
+    def key(before_digest, after_digest, params):
+        return content_hash(before_digest, after_digest, params)
+
+    @staticmethod
+    def _artifacts_exist(result):
+        # a write still in flight counts; a failed one leaves no file
+        return all(
+            os.path.exists(result[k]) or artifact_pending(result[k])
+            for k in ARTIFACT_KEYS
+            if result.get(k)
+        )
+
+    def get(self, key):
+        result = self.memory.get(key)
+
+        if result is None and self.disk is not None:
+            result = self.disk.get(key)
+            if result is not None:
+                self.memory.put(key, result)
+
+        if result is None:
+            return None
+
+        # artifacts were cleaned up or failed to write -> stale entry
+        if not self._artifacts_exist(result):
+            self.memory.pop(key)
+            if self.disk is not None:
+                self.disk.delete(key)
+            return None
+
+        return result
+
+    def put(self, key, result):
+        self.memory.put(key, result)
+        if self.disk is not None:
+            self.disk.put(key, result)
+
+
+_result_cache = None
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
+
+
+# =========================================================
+# PER-IMAGE FEATURE CACHE
+# =========================================================
+class FeatureCache:
+    """
+    Per-image analysis artifacts (ORB features, rust mask, metrics,
+    detections, ...) keyed by the image's content hash, so a baseline
+    photo compared against many "after" photos is analyzed once.
+    The disk store is shared by the OpenCV worker processes.
+    """
+
+    def __init__(self, max_entries=FEATURE_CACHE_ENTRIES,
+                 directory=FEATURE_CACHE_DIR, max_mb=FEATURE_CACHE_MAX_MB):
+        self.memory = LRUCache(max_entries)
+        self.disk = (
+            DiskCache(directory, max_mb * 1024 * 1024, codec="pickle")
+            if directory else None
+        )
+
+    @staticmethod
+    def key(image_digest, kind, params):
+        return content_hash(image_digest, kind, params)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+
+_feature_cache = None
+
+
+def get_feature_cache():
+    global _feature_cache
+    if _feature_cache is None:
+        _feature_cache = FeatureCache()
+    return _feature_cache
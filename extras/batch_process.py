@@ -1,478 +1,860 @@
-# #!/usr/bin/env python3
-# """
-# Batch processing utility for comparing multiple image pairs
-# Useful for analyzing entire folders or monitoring multiple equipment pieces
-# """
-
-# import os
-# import glob
-# import argparse
-# from pathlib import Path
-# from datetime import datetime
-# import json
-# from enhanced_comparison import compare_images
-# from dashboard_generator import ComparisonDashboard
-
-
-# def find_image_pairs(before_dir, after_dir, pattern="*.jpg"):
-#     """
-#     Automatically match before/after images based on filename
-    
-#     Args:
-#         before_dir: Directory containing "before" images
-#         after_dir: Directory containing "after" images  
-#         pattern: Filename pattern to match (default: *.jpg)
-    
-#     Returns:
-#         List of (before_path, after_path) tuples
-#     """
-#     before_files = glob.glob(os.path.join(before_dir, pattern))
-#     pairs = []
-    
-#     for before_path in sorted(before_files):
-#         filename = os.path.basename(before_path)
-#         after_path = os.path.join(after_dir, filename)
-        
-#         if os.path.exists(after_path):
-#             pairs.append((before_path, after_path))
-#         else:
-#             print(f"⚠️  Warning: No matching 'after' image for {filename}")
-    
-#     return pairs
-
-
-# def process_batch(pairs, output_dir="batch_results", create_reports=True):
-#     """
-#     Process multiple image pairs in batch
-    
-#     Args:
-#         pairs: List of (before_path, after_path) tuples
-#         output_dir: Base directory for all outputs
-#         create_reports: Whether to generate HTML/dashboard for each pair
-    
-#     Returns:
-#         Summary dictionary with all results
-#     """
-#     os.makedirs(output_dir, exist_ok=True)
-    
-#     print("=" * 80)
-#     print(f"🔄 BATCH PROCESSING - {len(pairs)} IMAGE PAIRS")
-#     print("=" * 80)
-#     print()
-    
-#     all_results = []
-#     summary_stats = {
-#         'total_pairs': len(pairs),
-#         'successful': 0,
-#         'failed': 0,
-#         'critical_changes': 0,
-#         'moderate_changes': 0,
-#         'minimal_changes': 0,
-#         'avg_change_percent': 0,
-#         'avg_rust_delta': 0,
-#         'total_new_cracks': 0,
-#     }
-    
-#     for i, (before_path, after_path) in enumerate(pairs, 1):
-#         print(f"\n{'='*80}")
-#         print(f"📸 Processing Pair {i}/{len(pairs)}")
-#         print(f"{'='*80}")
-#         print(f"Before: {os.path.basename(before_path)}")
-#         print(f"After:  {os.path.basename(after_path)}")
-#         print()
-        
-#         # Create output directory for this pair
-#         pair_name = Path(before_path).stem
-#         pair_output_dir = os.path.join(output_dir, f"{i:03d}_{pair_name}")
-#         os.makedirs(pair_output_dir, exist_ok=True)
-        
-#         try:
-#             # Run comparison
-#             annotated_path = os.path.join(pair_output_dir, "annotated.jpg")
-#             results = compare_images(
-#                 before_path,
-#                 after_path,
-#                 annotated_path,
-#                 enable_alignment=True
-#             )
-            
-#             results['annotated_path'] = annotated_path
-            
-#             # Quick summary
-#             change = results['change_percent']
-#             print(f"✅ Analysis complete!")
-#             print(f"   Similarity: {results['similarity']:.2%}")
-#             print(f"   Change: {change:.2f}%")
-#             print(f"   Regions: {results['regions']}")
-#             print(f"   Rust Δ: {results['rust_delta_pct']:+.2f}%")
-#             print(f"   New Cracks: {results['crack_delta']}")
-            
-#             # Classify change level
-#             if change > 20:
-#                 level = 'CRITICAL'
-#                 summary_stats['critical_changes'] += 1
-#             elif change > 10:
-#                 level = 'MODERATE'
-#                 summary_stats['moderate_changes'] += 1
-#             else:
-#                 level = 'MINIMAL'
-#                 summary_stats['minimal_changes'] += 1
-            
-#             print(f"   Status: {level}")
-            
-#             # Generate reports if requested
-#             if create_reports:
-#                 print(f"\n📊 Generating reports...")
-#                 dashboard = ComparisonDashboard(results, before_path, after_path)
-                
-#                 dashboard.create_full_dashboard(
-#                     os.path.join(pair_output_dir, "dashboard.png")
-#                 )
-#                 dashboard.create_html_report(
-#                     os.path.join(pair_output_dir, "report.html")
-#                 )
-#                 dashboard.create_json_report(
-#                     os.path.join(pair_output_dir, "results.json")
-#                 )
-            
-#             # Store results
-#             all_results.append({
-#                 'pair_id': i,
-#                 'pair_name': pair_name,
-#                 'before': before_path,
-#                 'after': after_path,
-#                 'output_dir': pair_output_dir,
-#                 'level': level,
-#                 'results': results
-#             })
-            
-#             summary_stats['successful'] += 1
-#             summary_stats['avg_change_percent'] += change
-#             summary_stats['avg_rust_delta'] += results['rust_delta_pct']
-#             summary_stats['total_new_cracks'] += results['crack_delta']
-            
-#         except Exception as e:
-#             print(f"❌ Error processing pair: {e}")
-#             import traceback
-#             traceback.print_exc()
-#             summary_stats['failed'] += 1
-    
-#     # Calculate averages
-#     if summary_stats['successful'] > 0:
-#         summary_stats['avg_change_percent'] /= summary_stats['successful']
-#         summary_stats['avg_rust_delta'] /= summary_stats['successful']
-    
-#     # Create batch summary report
-#     create_batch_summary(all_results, summary_stats, output_dir)
-    
-#     return all_results, summary_stats
-
-
-# def create_batch_summary(all_results, stats, output_dir):
-#     """
-#     Create a master summary HTML report for all pairs
-#     """
-#     html_template = """
-# <!DOCTYPE html>
-# <html lang="en">
-# <head>
-#     <meta charset="UTF-8">
-#     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-#     <title>Batch Comparison Summary</title>
-#     <style>
-#         * { margin: 0; padding: 0; box-sizing: border-box; }
-#         body {
-#             font-family: 'Segoe UI', sans-serif;
-#             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-#             padding: 20px;
-#         }
-#         .container {
-#             max-width: 1200px;
-#             margin: 0 auto;
-#             background: white;
-#             border-radius: 15px;
-#             overflow: hidden;
-#             box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-#         }
-#         .header {
-#             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-#             color: white;
-#             padding: 40px;
-#             text-align: center;
-#         }
-#         .header h1 { font-size: 2.5em; margin-bottom: 10px; }
-#         .stats {
-#             display: grid;
-#             grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-#             gap: 20px;
-#             padding: 40px;
-#             background: #f8f9fa;
-#         }
-#         .stat-card {
-#             background: white;
-#             padding: 20px;
-#             border-radius: 10px;
-#             text-align: center;
-#             box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-#         }
-#         .stat-value {
-#             font-size: 2.5em;
-#             font-weight: bold;
-#             color: #667eea;
-#             margin: 10px 0;
-#         }
-#         .stat-label {
-#             color: #666;
-#             font-size: 0.9em;
-#             text-transform: uppercase;
-#             letter-spacing: 1px;
-#         }
-#         .results-table {
-#             padding: 40px;
-#         }
-#         table {
-#             width: 100%;
-#             border-collapse: collapse;
-#             margin-top: 20px;
-#         }
-#         th {
-#             background: #667eea;
-#             color: white;
-#             padding: 15px;
-#             text-align: left;
-#             font-weight: 600;
-#         }
-#         td {
-#             padding: 12px 15px;
-#             border-bottom: 1px solid #eee;
-#         }
-#         tr:hover { background: #f8f9fa; }
-#         .badge {
-#             display: inline-block;
-#             padding: 5px 12px;
-#             border-radius: 15px;
-#             font-size: 0.85em;
-#             font-weight: bold;
-#         }
-#         .badge-critical { background: #ff6b6b; color: white; }
-#         .badge-moderate { background: #ffa500; color: white; }
-#         .badge-minimal { background: #51cf66; color: white; }
-#         a { color: #667eea; text-decoration: none; }
-#         a:hover { text-decoration: underline; }
-#     </style>
-# </head>
-# <body>
-#     <div class="container">
-#         <div class="header">
-#             <h1>📊 Batch Comparison Summary</h1>
-#             <p>Generated: {timestamp}</p>
-#         </div>
-        
-#         <div class="stats">
-#             <div class="stat-card">
-#                 <div class="stat-label">Total Pairs</div>
-#                 <div class="stat-value">{total_pairs}</div>
-#             </div>
-#             <div class="stat-card">
-#                 <div class="stat-label">Successful</div>
-#                 <div class="stat-value" style="color: #51cf66;">{successful}</div>
-#             </div>
-#             <div class="stat-card">
-#                 <div class="stat-label">Failed</div>
-#                 <div class="stat-value" style="color: #ff6b6b;">{failed}</div>
-#             </div>
-#             <div class="stat-card">
-#                 <div class="stat-label">Critical Changes</div>
-#                 <div class="stat-value" style="color: #ff6b6b;">{critical}</div>
-#             </div>
-#             <div class="stat-card">
-#                 <div class="stat-label">Moderate Changes</div>
-#                 <div class="stat-value" style="color: #ffa500;">{moderate}</div>
-#             </div>
-#             <div class="stat-card">
-#                 <div class="stat-label">Minimal Changes</div>
-#                 <div class="stat-value" style="color: #51cf66;">{minimal}</div>
-#             </div>
-#             <div class="stat-card">
-#                 <div class="stat-label">Avg Change</div>
-#                 <div class="stat-value">{avg_change:.1f}%</div>
-#             </div>
-#             <div class="stat-card">
-#                 <div class="stat-label">Total New Cracks</div>
-#                 <div class="stat-value">{total_cracks}</div>
-#             </div>
-#         </div>
-        
-#         <div class="results-table">
-#             <h2>Detailed Results</h2>
-#             <table>
-#                 <thead>
-#                     <tr>
-#                         <th>#</th>
-#                         <th>Image Pair</th>
-#                         <th>Status</th>
-#                         <th>Change %</th>
-#                         <th>Rust Δ</th>
-#                         <th>New Cracks</th>
-#                         <th>Regions</th>
-#                         <th>Report</th>
-#                     </tr>
-#                 </thead>
-#                 <tbody>
-#                     {table_rows}
-#                 </tbody>
-#             </table>
-#         </div>
-#     </div>
-# </body>
-# </html>
-# """
-    
-#     # Generate table rows
-#     rows = ""
-#     for result in all_results:
-#         r = result['results']
-#         badge_class = f"badge-{result['level'].lower()}"
-        
-#         report_link = f"{result['pair_id']:03d}_{result['pair_name']}/report.html"
-        
-#         rows += f"""
-#         <tr>
-#             <td>{result['pair_id']}</td>
-#             <td>{result['pair_name']}</td>
-#             <td><span class="badge {badge_class}">{result['level']}</span></td>
-#             <td>{r['change_percent']:.2f}%</td>
-#             <td>{r['rust_delta_pct']:+.2f}%</td>
-#             <td>{r['crack_delta']}</td>
-#             <td>{r['regions']}</td>
-#             <td><a href="{report_link}">View Report →</a></td>
-#         </tr>
-#         """
-    
-#     # Fill template
-#     html = html_template.format(
-#         timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-#         total_pairs=stats['total_pairs'],
-#         successful=stats['successful'],
-#         failed=stats['failed'],
-#         critical=stats['critical_changes'],
-#         moderate=stats['moderate_changes'],
-#         minimal=stats['minimal_changes'],
-#         avg_change=stats['avg_change_percent'],
-#         total_cracks=stats['total_new_cracks'],
-#         table_rows=rows
-#     )
-    
-#     # Save
-#     summary_path = os.path.join(output_dir, "batch_summary.html")
-#     with open(summary_path, 'w') as f:
-#         f.write(html)
-    
-#     # Also save JSON
-#     json_path = os.path.join(output_dir, "batch_summary.json")
-#     with open(json_path, 'w') as f:
-#         json.dump({
-#             'timestamp': datetime.now().isoformat(),
-#             'statistics': stats,
-#             'results': [
-#                 {
-#                     'pair_id': r['pair_id'],
-#                     'pair_name': r['pair_name'],
-#                     'level': r['level'],
-#                     'before': r['before'],
-#                     'after': r['after'],
-#                     'output_dir': r['output_dir'],
-#                     'metrics': {
-#                         'similarity': r['results']['similarity'],
-#                         'change_percent': r['results']['change_percent'],
-#                         'rust_delta_pct': r['results']['rust_delta_pct'],
-#                         'crack_delta': r['results']['crack_delta'],
-#                         'regions': r['results']['regions'],
-#                     }
-#                 }
-#                 for r in all_results
-#             ]
-#         }, f, indent=2)
-    
-#     print(f"\n✅ Batch summary saved:")
-#     print(f"   HTML: {summary_path}")
-#     print(f"   JSON: {json_path}")
-
-
-# def main():
-#     parser = argparse.ArgumentParser(
-#         description='Batch process multiple image pairs for comparison',
-#         formatter_class=argparse.RawDescriptionHelpFormatter,
-#         epilog="""
-# Examples:
-#   # Process all JPG images from two directories
-#   python batch_process.py --before before_images/ --after after_images/
-  
-#   # Process specific image pairs
-#   python batch_process.py --pairs before1.jpg,after1.jpg before2.jpg,after2.jpg
-  
-#   # Quick mode (no HTML/dashboard generation)
-#   python batch_process.py --before before/ --after after/ --quick
-#         """
-#     )
-    
-#     parser.add_argument('--before', help='Directory containing before images')
-#     parser.add_argument('--after', help='Directory containing after images')
-#     parser.add_argument('--pairs', nargs='+', help='Explicit pairs as before,after')
-#     parser.add_argument('--pattern', default='*.jpg', help='Filename pattern (default: *.jpg)')
-#     parser.add_argument('--output', default='batch_results', help='Output directory')
-#     parser.add_argument('--quick', action='store_true', help='Skip HTML/dashboard generation')
-    
-#     args = parser.parse_args()
-    
-#     # Determine image pairs
-#     pairs = []
-    
-#     if args.pairs:
-#         # Explicit pairs from command line
-#         for pair_str in args.pairs:
-#             before, after = pair_str.split(',')
-#             if os.path.exists(before) and os.path.exists(after):
-#                 pairs.append((before, after))
-#             else:
-#                 print(f"⚠️  Warning: Could not find pair: {pair_str}")
-    
-#     elif args.before and args.after:
-#         # Auto-match from directories
-#         pairs = find_image_pairs(args.before, args.after, args.pattern)
-    
-#     else:
-#         parser.print_help()
-#         return
-    
-#     if not pairs:
-#         print("❌ No valid image pairs found!")
-#         return
-    
-#     # Process batch
-#     results, stats = process_batch(
-#         pairs,
-#         output_dir=args.output,
-#         create_reports=not args.quick
-#     )
-    
-#     # Print final summary
-#     print("\n" + "=" * 80)
-#     print("📊 BATCH PROCESSING COMPLETE")
-#     print("=" * 80)
-#     print(f"Total Pairs:         {stats['total_pairs']}")
-#     print(f"Successful:          {stats['successful']}")
-#     print(f"Failed:              {stats['failed']}")
-#     print(f"Critical Changes:    {stats['critical_changes']}")
-#     print(f"Moderate Changes:    {stats['moderate_changes']}")
-#     print(f"Minimal Changes:     {stats['minimal_changes']}")
-#     print(f"Average Change:      {stats['avg_change_percent']:.2f}%")
-#     print(f"Total New Cracks:    {stats['total_new_cracks']}")
-#     print()
-#     print(f"Results saved to: {args.output}/")
-#     print(f"Open batch_summary.html for interactive overview")
-#     print("=" * 80)
-
-
-# if __name__ == "__main__":
-#     main()
\ No newline at end of file
+#!/usr/bin/env python3
+"""
+Batch processing utility for comparing multiple image pairs
+Useful for analyzing entire folders or monitoring multiple equipment pieces
+
+Pairs are streamed from directories or a manifest, compared in a
+process pool with a bounded number of pairs in flight, and each result
+is appended to results.jsonl as soon as it finishes.
+
+A checkpoint ledger (checkpoint.db, SQLite) records every pair's
+status, attempts, input hashes and output paths. Re-running the same
+command skips finished pairs, retries failed or interrupted ones and
+re-processes pairs whose input images changed.
+
+Run from the repository root:
+    python -m extras.batch_process --before before/ --after after/
+"""
+
+import os
+import csv
+import json
+import fnmatch
+import hashlib
+import sqlite3
+import argparse
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+
+from caching import file_hash
+from image_diff import compare_images, init_worker
+from artifacts import flush as flush_artifacts
+from comparison_builder import build_comparison_json
+from bedrock_report import generate_bedrock_reports_batch, REPORT_BATCH_SIZE
+from pipeline import NO_CHANGE_REPORT
+
+
+RESULTS_FILE = "results.jsonl"
+LEDGER_FILE = "checkpoint.db"
+
+
+# =========================================================
+# PAIR SOURCES (generators — nothing is held in memory)
+# =========================================================
+def find_image_pairs(before_dir, after_dir, pattern="*.jpg"):
+    """
+    Automatically match before/after images based on filename
+
+    Args:
+        before_dir: Directory containing "before" images
+        after_dir: Directory containing "after" images
+        pattern: Filename pattern to match (default: *.jpg)
+
+    Yields:
+        (pair_id, before_path, after_path) tuples
+    """
+    names = sorted(
+        entry.name
+        for entry in os.scandir(before_dir)
+        if entry.is_file() and fnmatch.fnmatch(entry.name, pattern)
+    )
+
+    for filename in names:
+        before_path = os.path.join(before_dir, filename)
+        after_path = os.path.join(after_dir, filename)
+
+        if os.path.exists(after_path):
+            yield os.path.splitext(filename)[0], before_path, after_path
+        else:
+            print(f"⚠️  Warning: No matching 'after' image for {filename}")
+
+
+def _manifest_id(before_path, after_path):
+    digest = hashlib.sha1(f"{before_path}|{after_path}".encode()).hexdigest()
+    return f"{os.path.splitext(os.path.basename(before_path))[0]}_{digest[:8]}"
+
+
+def read_manifest(path):
+    """
+    Stream pairs from a manifest:
+    - .jsonl: one {"before": ..., "after": ..., "id": optional} per line
+    - .csv: columns before,after[,id] (header row required)
+
+    Yields:
+        (pair_id, before_path, after_path) tuples
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+
+        for row in rows:
+            before_path, after_path = row["before"], row["after"]
+            pair_id = row.get("id") or _manifest_id(before_path, after_path)
+            yield pair_id, before_path, after_path
+
+
+def explicit_pairs(pair_strings):
+    """Pairs given on the command line as before,after"""
+    for pair_str in pair_strings:
+        before_path, after_path = pair_str.split(',')
+        if os.path.exists(before_path) and os.path.exists(after_path):
+            yield _manifest_id(before_path, after_path), before_path, after_path
+        else:
+            print(f"⚠️  Warning: Could not find pair: {pair_str}")
+
+
+# =========================================================
+# WORKER
+# =========================================================
+def classify_level(change):
+    if change > 20:
+        return 'CRITICAL'
+    if change > 10:
+        return 'MODERATE'
+    return 'MINIMAL'
+
+
+def _safe_name(pair_id):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in pair_id)
+
+
+def _stat(path):
+    """Cheap change check; content is only re-hashed when this differs"""
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def process_pair(pair_id, before_path, after_path, output_dir):
+    """
+    Compare one pair (runs in a worker process).
+    Full results go to <output_dir>/<pair>/results.json; the returned
+    record is the compact line written to results.jsonl and the ledger.
+    """
+    pair_output_dir = os.path.join(output_dir, _safe_name(pair_id))
+    os.makedirs(pair_output_dir, exist_ok=True)
+
+    record = {
+        'pair_id': pair_id,
+        'before': before_path,
+        'after': after_path,
+        'output_dir': pair_output_dir,
+    }
+
+    try:
+        record['inputs'] = {
+            'before_stat': _stat(before_path),
+            'after_stat': _stat(after_path),
+            'before_hash': file_hash(before_path),
+            'after_hash': file_hash(after_path),
+        }
+
+        annotated_path = os.path.join(pair_output_dir, "annotated.jpg")
+        results_path = os.path.join(pair_output_dir, "results.json")
+
+        # a report from earlier inputs must not outlive their results
+        try:
+            os.remove(os.path.join(pair_output_dir, "report.txt"))
+        except FileNotFoundError:
+            pass
+
+        results = compare_images(
+            before_path,
+            after_path,
+            annotated_path,
+            enable_alignment=True
+        )
+        # "ok" in the ledger means the images are on disk
+        flush_artifacts()
+
+        with open(results_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        record.update({
+            'status': 'ok',
+            'level': classify_level(results['change_percent']),
+            'outputs': [
+                p for p in (results['annotated_path'], results_path) if p
+            ],
+            'metrics': {
+                'similarity': results['similarity'],
+                'change_percent': results['change_percent'],
+                'rust_delta_pct': results['rust_delta_pct'],
+                'crack_delta': results['crack_delta'],
+                'regions': results['regions'],
+            }
+        })
+
+    except Exception as e:
+        record.update({'status': 'failed', 'error': f"{type(e).__name__}: {e}"})
+
+    return record
+
+
+# =========================================================
+# CHECKPOINT LEDGER
+# One row per pair: status, attempts, input fingerprints and the
+# latest record. Only the parent process writes to it.
+# =========================================================
+RUNNING = "running"
+OK = "ok"
+FAILED = "failed"
+
+
+class BatchLedger:
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pairs (
+                pair_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                before_path TEXT NOT NULL,
+                after_path TEXT NOT NULL,
+                before_stat TEXT,
+                after_stat TEXT,
+                before_hash TEXT,
+                after_hash TEXT,
+                updated_at REAL NOT NULL,
+                record TEXT
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get(self, pair_id):
+        row = self.conn.execute(
+            "SELECT status, attempts, before_path, after_path, before_stat, "
+            "after_stat, before_hash, after_hash, record "
+            "FROM pairs WHERE pair_id = ?",
+            (pair_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        keys = ("status", "attempts", "before_path", "after_path", "before_stat",
+                "after_stat", "before_hash", "after_hash", "record")
+        entry = dict(zip(keys, row))
+        entry["record"] = json.loads(entry["record"]) if entry["record"] else None
+        return entry
+
+    def mark_running(self, pair_id, before_path, after_path, attempts):
+        # a crash leaves the row "running", which is retried next time
+        self.conn.execute(
+            """
+            INSERT INTO pairs (pair_id, status, attempts, before_path, after_path, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(pair_id) DO UPDATE SET
+                status = excluded.status,
+                attempts = excluded.attempts,
+                before_path = excluded.before_path,
+                after_path = excluded.after_path,
+                updated_at = excluded.updated_at
+            """,
+            (pair_id, RUNNING, attempts, before_path, after_path, time.time())
+        )
+        self.conn.commit()
+
+    def record(self, record):
+        inputs = record.get('inputs', {})
+        self.conn.execute(
+            """
+            UPDATE pairs SET status = ?,
+                before_stat = COALESCE(?, before_stat),
+                after_stat = COALESCE(?, after_stat),
+                before_hash = COALESCE(?, before_hash),
+                after_hash = COALESCE(?, after_hash),
+                updated_at = ?, record = ?
+            WHERE pair_id = ?
+            """,
+            (
+                record['status'],
+                inputs.get('before_stat'),
+                inputs.get('after_stat'),
+                inputs.get('before_hash'),
+                inputs.get('after_hash'),
+                time.time(),
+                json.dumps(record),
+                record['pair_id'],
+            )
+        )
+        self.conn.commit()
+
+    def refresh_stats(self, pair_id, before_stat, after_stat):
+        # touched but identical inputs: remember the new stat
+        self.conn.execute(
+            "UPDATE pairs SET before_stat = ?, after_stat = ? WHERE pair_id = ?",
+            (before_stat, after_stat, pair_id)
+        )
+        self.conn.commit()
+
+    def records(self):
+        """Latest finished record per pair (streamed from a cursor)"""
+        cursor = self.conn.execute(
+            "SELECT record FROM pairs WHERE status IN (?, ?) ORDER BY pair_id",
+            (OK, FAILED)
+        )
+        for (record,) in cursor:
+            yield json.loads(record)
+
+    def clear(self):
+        self.conn.execute("DELETE FROM pairs")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _outputs_exist(record):
+    return all(os.path.exists(p) for p in record.get('outputs', []))
+
+
+def plan_pair(ledger, pair_id, before_path, after_path, max_attempts):
+    """
+    Decide what to do with a pair: ("skip" | "run" | "exhausted", attempts)
+
+    - finished, same inputs, outputs present -> skip
+    - failed -> retry, up to max_attempts
+    - interrupted (left "running" by a crash) -> retry, not counted
+    - inputs changed (stat, then content hash) or missing -> re-run
+      from attempt 0 (a missing input is recorded as failed)
+    """
+    entry = ledger.get(pair_id)
+    if entry is None:
+        return "run", 0
+
+    same_paths = (entry["before_path"], entry["after_path"]) == (before_path, after_path)
+
+    try:
+        before_stat, after_stat = _stat(before_path), _stat(after_path)
+    except OSError:
+        # missing input: never "unchanged", the worker records the failure
+        return "run", 0
+
+    if entry["before_stat"] is None:
+        # never fingerprinted (crashed or failed before hashing)
+        unchanged = same_paths
+    else:
+        unchanged = same_paths and (entry["before_stat"], entry["after_stat"]) == (before_stat, after_stat)
+
+    if same_paths and not unchanged and entry["before_hash"]:
+        # mtime/size moved; only the content decides
+        unchanged = (
+            file_hash(before_path) == entry["before_hash"]
+            and file_hash(after_path) == entry["after_hash"]
+        )
+        if unchanged:
+            ledger.refresh_stats(pair_id, before_stat, after_stat)
+
+    if not unchanged:
+        return "run", 0
+
+    if entry["status"] == OK and _outputs_exist(entry["record"]):
+        return "skip", entry["attempts"]
+
+    attempts = entry["attempts"]
+    if entry["status"] == RUNNING:
+        # the attempt never finished, so it did not fail either
+        attempts -= 1
+
+    if entry["status"] != OK and attempts >= max_attempts:
+        return "exhausted", attempts
+
+    return "run", attempts
+
+
+# =========================================================
+# BATCH DRIVER
+# =========================================================
+def process_batch(pairs, output_dir="batch_results", workers=None,
+                  max_inflight=None, resume=True, max_attempts=3):
+    """
+    Process image pairs in a process pool
+
+    Args:
+        pairs: Iterable of (pair_id, before_path, after_path)
+        output_dir: Base directory for all outputs
+        workers: Pool size (default: number of cores)
+        max_inflight: Pairs submitted but not finished (default: 2 x workers)
+        resume: Use the checkpoint ledger to skip finished pairs
+        max_attempts: Give up on a pair after this many failed attempts
+
+    Returns:
+        The BatchLedger holding every pair's latest record
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    ledger = BatchLedger(os.path.join(output_dir, LEDGER_FILE))
+
+    workers = workers or os.cpu_count() or 1
+    max_inflight = max_inflight or 2 * workers
+
+    if not resume:
+        ledger.clear()
+        if os.path.exists(results_path):
+            os.remove(results_path)
+
+    print("=" * 80)
+    print(f"🔄 BATCH PROCESSING - {workers} workers")
+    print("=" * 80)
+
+    counts = {OK: 0, FAILED: 0, 'skipped': 0, 'exhausted': 0}
+
+    with open(results_path, 'a') as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+
+        inflight = set()
+
+        def drain(return_when):
+            nonlocal inflight
+            done, inflight = wait(inflight, return_when=return_when)
+            for fut in done:
+                record = fut.result()
+                ledger.record(record)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                counts[record['status']] += 1
+
+                marker = "✅" if record['status'] == OK else "❌"
+                print(f"{marker} {record['pair_id']}: "
+                      f"{record.get('level') or record.get('error')}")
+
+        for pair_id, before_path, after_path in pairs:
+            action, attempts = plan_pair(
+                ledger, pair_id, before_path, after_path, max_attempts
+            )
+            if action == "skip":
+                counts['skipped'] += 1
+                continue
+            if action == "exhausted":
+                counts['exhausted'] += 1
+                continue
+
+            # bounded in-flight work keeps memory flat
+            if len(inflight) >= max_inflight:
+                drain(FIRST_COMPLETED)
+
+            ledger.mark_running(pair_id, before_path, after_path, attempts + 1)
+            inflight.add(pool.submit(
+                process_pair, pair_id, before_path, after_path, output_dir
+            ))
+
+        if inflight:
+            drain(ALL_COMPLETED)
+
+    print(f"\nProcessed: {counts[OK]} ok, {counts[FAILED]} failed, "
+          f"{counts['skipped']} skipped (already done), "
+          f"{counts['exhausted']} given up (>= {max_attempts} attempts)")
+
+    return ledger
+
+
+# =========================================================
+# LLM REPORTS
+# Several pairs per Bedrock request; pairs the batched reply misses
+# are retried one by one inside generate_bedrock_reports_batch.
+# =========================================================
+def generate_reports(ledger, batch_size=REPORT_BATCH_SIZE):
+    """
+    Write <pair>/report.txt for every successful pair that has no
+    report newer than its results.json. Fast-path pairs get the canned
+    no-change report (as the API does) without an LLM call.
+    Returns {"written", "cached", "failed"} counts.
+    """
+    pending = []
+    for record in ledger.records():
+        if record.get('status') != 'ok':
+            continue
+        report_path = os.path.join(record['output_dir'], "report.txt")
+        results_path = os.path.join(record['output_dir'], "results.json")
+        try:
+            if os.path.getmtime(report_path) >= os.path.getmtime(results_path):
+                continue
+        except OSError:
+            pass
+        pending.append((record['pair_id'], results_path, report_path))
+
+    stats = {'written': 0, 'cached': 0, 'failed': 0}
+    for start in range(0, len(pending), batch_size * 4):
+        # a few requests' worth of results.json in memory at a time
+        chunk = pending[start:start + batch_size * 4]
+        to_generate = []
+        comparisons = []
+        for pair_id, results_path, report_path in chunk:
+            with open(results_path) as f:
+                results = json.load(f)
+
+            if results.get('fast_path'):
+                with open(report_path, 'w') as f:
+                    f.write(NO_CHANGE_REPORT)
+                stats['written'] += 1
+                continue
+
+            to_generate.append((pair_id, results_path, report_path))
+            # batch runs skip object detection
+            comparisons.append(build_comparison_json(results, [], [], [], []))
+
+        results = generate_bedrock_reports_batch(comparisons, batch_size=batch_size)
+
+        for (pair_id, _, report_path), item in zip(to_generate, results):
+            if item['report'] is None:
+                stats['failed'] += 1
+                print(f"  ✗ report {pair_id}: {item['error']}")
+                continue
+            with open(report_path, 'w') as f:
+                f.write(item['report'])
+            stats['written'] += 1
+            if item['source'] == 'cache':
+                stats['cached'] += 1
+
+        print(f"Reports: {min(start + len(chunk), len(pending))}/{len(pending)}")
+
+    return stats
+
+
+def create_batch_summary(ledger, output_dir):
+    """
+    Create a master summary HTML/JSON report, streaming over the ledger
+    """
+    stats = {
+        'total_pairs': 0,
+        'successful': 0,
+        'failed': 0,
+        'critical_changes': 0,
+        'moderate_changes': 0,
+        'minimal_changes': 0,
+        'avg_change_percent': 0,
+        'avg_rust_delta': 0,
+        'total_new_cracks': 0,
+    }
+    level_key = {
+        'CRITICAL': 'critical_changes',
+        'MODERATE': 'moderate_changes',
+        'MINIMAL': 'minimal_changes',
+    }
+
+    rows_path = os.path.join(output_dir, "batch_summary.rows.tmp")
+    with open(rows_path, 'w') as rows:
+        for record in ledger.records():
+            stats['total_pairs'] += 1
+
+            if record['status'] != 'ok':
+                stats['failed'] += 1
+                continue
+
+            r = record['metrics']
+            stats['successful'] += 1
+            stats[level_key[record['level']]] += 1
+            stats['avg_change_percent'] += r['change_percent']
+            stats['avg_rust_delta'] += r['rust_delta_pct']
+            stats['total_new_cracks'] += r['crack_delta']
+
+            badge_class = f"badge-{record['level'].lower()}"
+            link = os.path.relpath(
+                os.path.join(record['output_dir'], "annotated.jpg"), output_dir
+            )
+            rows.write(f"""
+        <tr>
+            <td>{stats['successful']}</td>
+            <td>{record['pair_id']}</td>
+            <td><span class="badge {badge_class}">{record['level']}</span></td>
+            <td>{r['change_percent']:.2f}%</td>
+            <td>{r['rust_delta_pct']:+.2f}%</td>
+            <td>{r['crack_delta']}</td>
+            <td>{r['regions']}</td>
+            <td><a href="{link}">View Image →</a></td>
+        </tr>
+        """)
+
+    # Calculate averages
+    if stats['successful'] > 0:
+        stats['avg_change_percent'] /= stats['successful']
+        stats['avg_rust_delta'] /= stats['successful']
+
+    head, tail = SUMMARY_TEMPLATE.split("{table_rows}")
+    head = head.format(
+        timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        total_pairs=stats['total_pairs'],
+        successful=stats['successful'],
+        failed=stats['failed'],
+        critical=stats['critical_changes'],
+        moderate=stats['moderate_changes'],
+        minimal=stats['minimal_changes'],
+        avg_change=stats['avg_change_percent'],
+        total_cracks=stats['total_new_cracks'],
+    )
+
+    # Save (rows are copied in chunks, never held in memory)
+    summary_path = os.path.join(output_dir, "batch_summary.html")
+    with open(summary_path, 'w') as f, open(rows_path) as rows:
+        f.write(head)
+        for chunk in iter(lambda: rows.read(1 << 16), ""):
+            f.write(chunk)
+        f.write(tail)
+    os.remove(rows_path)
+
+    # Also save JSON (per-pair records stay in results.jsonl)
+    json_path = os.path.join(output_dir, "batch_summary.json")
+    with open(json_path, 'w') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'statistics': stats,
+            'results_file': os.path.join(output_dir, RESULTS_FILE),
+            'ledger': os.path.join(output_dir, LEDGER_FILE),
+        }, f, indent=2)
+
+    print(f"\n✅ Batch summary saved:")
+    print(f"   HTML: {summary_path}")
+    print(f"   JSON: {json_path}")
+
+    return stats
+
+
+SUMMARY_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Batch Comparison Summary</title>
+    <style>
+        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
+        body {{
+            font-family: 'Segoe UI', sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            padding: 20px;
+        }}
+        .container {{
+            max-width: 1200px;
+            margin: 0 auto;
+            background: white;
+            border-radius: 15px;
+            overflow: hidden;
+            box-shadow: 0 20px 60px rgba(0,0,0,0.3);
+        }}
+        .header {{
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 40px;
+            text-align: center;
+        }}
+        .header h1 {{ font-size: 2.5em; margin-bottom: 10px; }}
+        .stats {{
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+            gap: 20px;
+            padding: 40px;
+            background: #f8f9fa;
+        }}
+        .stat-card {{
+            background: white;
+            padding: 20px;
+            border-radius: 10px;
+            text-align: center;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }}
+        .stat-value {{
+            font-size: 2.5em;
+            font-weight: bold;
+            color: #667eea;
+            margin: 10px 0;
+        }}
+        .stat-label {{
+            color: #666;
+            font-size: 0.9em;
+            text-transform: uppercase;
+            letter-spacing: 1px;
+        }}
+        .results-table {{ padding: 40px; }}
+        table {{ width: 100%; border-collapse: collapse; margin-top: 20px; }}
+        th {{
+            background: #667eea;
+            color: white;
+            padding: 15px;
+            text-align: left;
+            font-weight: 600;
+        }}
+        td {{ padding: 12px 15px; border-bottom: 1px solid #eee; }}
+        tr:hover {{ background: #f8f9fa; }}
+        .badge {{
+            display: inline-block;
+            padding: 5px 12px;
+            border-radius: 15px;
+            font-size: 0.85em;
+            font-weight: bold;
+        }}
+        .badge-critical {{ background: #ff6b6b; color: white; }}
+        .badge-moderate {{ background: #ffa500; color: white; }}
+        .badge-minimal {{ background: #51cf66; color: white; }}
+        a {{ color: #667eea; text-decoration: none; }}
+        a:hover {{ text-decoration: underline; }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>📊 Batch Comparison Summary</h1>
+            <p>Generated: {timestamp}</p>
+        </div>
+
+        <div class="stats">
+            <div class="stat-card">
+                <div class="stat-label">Total Pairs</div>
+                <div class="stat-value">{total_pairs}</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Successful</div>
+                <div class="stat-value" style="color: #51cf66;">{successful}</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Failed</div>
+                <div class="stat-value" style="color: #ff6b6b;">{failed}</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Critical Changes</div>
+                <div class="stat-value" style="color: #ff6b6b;">{critical}</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Moderate Changes</div>
+                <div class="stat-value" style="color: #ffa500;">{moderate}</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Minimal Changes</div>
+                <div class="stat-value" style="color: #51cf66;">{minimal}</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Avg Change</div>
+                <div class="stat-value">{avg_change:.1f}%</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-label">Total New Cracks</div>
+                <div class="stat-value">{total_cracks}</div>
+            </div>
+        </div>
+
+        <div class="results-table">
+            <h2>Detailed Results</h2>
+            <table>
+                <thead>
+                    <tr>
+                        <th>#</th>
+                        <th>Image Pair</th>
+                        <th>Status</th>
+                        <th>Change %</th>
+                        <th>Rust Δ</th>
+                        <th>New Cracks</th>
+                        <th>Regions</th>
+                        <th>Result</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {table_rows}
+                </tbody>
+            </table>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Batch process multiple image pairs for comparison',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Process all JPG images from two directories
+  python -m extras.batch_process --before before_images/ --after after_images/
+
+  # Process pairs listed in a manifest (CSV with before,after[,id] or JSONL)
+  python -m extras.batch_process --manifest survey.csv --workers 16
+
+  # Process specific image pairs
+  python -m extras.batch_process --pairs before1.jpg,after1.jpg before2.jpg,after2.jpg
+
+  # Also write an LLM report per pair, 8 pairs per Bedrock request
+  python -m extras.batch_process --manifest survey.csv --reports --report-batch-size 8
+
+  # Start over instead of resuming
+  python -m extras.batch_process --before before/ --after after/ --no-resume
+        """
+    )
+
+    parser.add_argument('--before', help='Directory containing before images')
+    parser.add_argument('--after', help='Directory containing after images')
+    parser.add_argument('--manifest', help='CSV or JSONL file listing pairs')
+    parser.add_argument('--pairs', nargs='+', help='Explicit pairs as before,after')
+    parser.add_argument('--pattern', default='*.jpg', help='Filename pattern (default: *.jpg)')
+    parser.add_argument('--output', default='batch_results', help='Output directory')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: cores)')
+    parser.add_argument('--max-inflight', type=int, default=None,
+                        help='Pairs in flight at once (default: 2 x workers)')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Clear the checkpoint ledger and process everything')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='Stop retrying a failing pair after N attempts (default: 3)')
+    parser.add_argument('--reports', action='store_true',
+                        help='Write an LLM report.txt per successful pair (Bedrock)')
+    parser.add_argument('--report-batch-size', type=int, default=REPORT_BATCH_SIZE,
+                        help=f'Pairs per Bedrock request (default: {REPORT_BATCH_SIZE})')
+
+    args = parser.parse_args()
+
+    # Determine image pairs
+    if args.pairs:
+        pairs = explicit_pairs(args.pairs)
+    elif args.manifest:
+        pairs = read_manifest(args.manifest)
+    elif args.before and args.after:
+        pairs = find_image_pairs(args.before, args.after, args.pattern)
+    else:
+        parser.print_help()
+        return
+
+    # Process batch
+    ledger = process_batch(
+        pairs,
+        output_dir=args.output,
+        workers=args.workers,
+        max_inflight=args.max_inflight,
+        resume=not args.no_resume,
+        max_attempts=args.max_attempts
+    )
+
+    report_stats = None
+    if args.reports:
+        report_stats = generate_reports(ledger, batch_size=args.report_batch_size)
+
+    stats = create_batch_summary(ledger, args.output)
+    ledger.close()
+
+    # Print final summary
+    print("\n" + "=" * 80)
+    print("📊 BATCH PROCESSING COMPLETE")
+    print("=" * 80)
+    print(f"Total Pairs:         {stats['total_pairs']}")
+    print(f"Successful:          {stats['successful']}")
+    print(f"Failed:              {stats['failed']}")
+    print(f"Critical Changes:    {stats['critical_changes']}")
+    print(f"Moderate Changes:    {stats['moderate_changes']}")
+    print(f"Minimal Changes:     {stats['minimal_changes']}")
+    print(f"Average Change:      {stats['avg_change_percent']:.2f}%")
+    print(f"Total New Cracks:    {stats['total_new_cracks']}")
+    if report_stats is not None:
+        print(f"Reports Written:     {report_stats['written']} "
+              f"({report_stats['cached']} cached, {report_stats['failed']} failed)")
+    print()
+    print(f"Results saved to: {args.output}/")
+    print(f"Open batch_summary.html for interactive overview")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
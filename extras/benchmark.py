@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the image_diff engine
+
+Synthesizes pump-like before/after images at several resolutions with
+controlled rust, crack and region changes, times each engine stage and
+the end-to-end compare_images call, and stores the numbers as JSON so
+two versions can be compared. Runs offline: no models, no network.
+
+Run from the repository root:
+    python -m extras.benchmark --output benchmarks/current.json
+    python -m extras.benchmark --compare benchmarks/baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import artifacts
+import image_diff
+from image_diff import (
+    ImageContext, SSIMEngine, align_images, enhanced_rust_score,
+    detect_cracks_and_damage, create_advanced_diff_mask, normalize_size,
+    compare_images
+)
+
+
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "12mp": (4000, 3000),
+}
+
+# how much the "after" image deteriorates
+CHANGE_LEVELS = {
+    "none": {"rust": 0, "cracks": 0, "regions": 0},
+    "low": {"rust": 2, "cracks": 1, "regions": 1},
+    "medium": {"rust": 5, "cracks": 3, "regions": 2},
+    "high": {"rust": 12, "cracks": 8, "regions": 4},
+}
+
+STAGES = (
+    "align_images",
+    "enhanced_rust_score",
+    "detect_cracks_and_damage",
+    "ssim",
+    "diff_mask",
+    "contours",
+    "image_writes",
+    "compare_images",
+)
+
+
+# =========================================================
+# SYNTHETIC IMAGES
+# =========================================================
+def synth_pump(width, height, seed=0):
+    """Gray painted pump: casing, flanges, pipe, bolts, surface noise"""
+    rng = np.random.default_rng(seed)
+
+    img = np.full((height, width, 3), (70, 72, 75), dtype=np.uint8)
+
+    # floor / wall split
+    cv2.rectangle(img, (0, int(height * 0.8)), (width, height), (55, 58, 60), -1)
+
+    cx, cy = width // 2, int(height * 0.5)
+    r = int(min(width, height) * 0.28)
+
+    # volute casing + motor body
+    cv2.circle(img, (cx, cy), r, (120, 125, 128), -1)
+    cv2.circle(img, (cx, cy), int(r * 0.55), (95, 100, 104), -1)
+    cv2.rectangle(
+        img, (cx + int(r * 0.6), cy - int(r * 0.45)),
+        (min(width - 1, cx + int(r * 2.2)), cy + int(r * 0.45)),
+        (110, 90, 60), -1
+    )
+
+    # discharge pipe with flange
+    pw = max(4, int(r * 0.3))
+    cv2.rectangle(img, (cx - pw, 0), (cx + pw, cy - r + 2), (130, 132, 135), -1)
+    cv2.rectangle(
+        img, (cx - int(pw * 1.6), cy - r - pw // 2),
+        (cx + int(pw * 1.6), cy - r + pw // 2), (100, 102, 105), -1
+    )
+
+    # bolt circle
+    for angle in np.linspace(0, 2 * np.pi, 12, endpoint=False):
+        bx = int(cx + np.cos(angle) * r * 0.8)
+        by = int(cy + np.sin(angle) * r * 0.8)
+        cv2.circle(img, (bx, by), max(2, r // 25), (40, 40, 42), -1)
+
+    # paint texture
+    noise = rng.normal(0, 6, img.shape).astype(np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def deteriorate(img, rust=0, cracks=0, regions=0, shift=(6, 4), seed=1):
+    """Apply a controlled amount of change plus a small camera shift"""
+    rng = np.random.default_rng(seed)
+    out = img.copy()
+    h, w = out.shape[:2]
+    unit = min(w, h)
+
+    for _ in range(rust):
+        x, y = int(rng.uniform(0.2, 0.8) * w), int(rng.uniform(0.2, 0.8) * h)
+        axes = (int(unit * rng.uniform(0.02, 0.06)), int(unit * rng.uniform(0.01, 0.04)))
+        cv2.ellipse(out, (x, y), axes, rng.uniform(0, 180), 0, 360, (30, 80, 160), -1)
+
+    for _ in range(cracks):
+        pts = [(int(rng.uniform(0.25, 0.75) * w), int(rng.uniform(0.25, 0.75) * h))]
+        for _ in range(6):
+            px, py = pts[-1]
+            pts.append((
+                int(px + rng.normal(0, unit * 0.03)),
+                int(py + unit * 0.025)
+            ))
+        cv2.polylines(out, [np.array(pts, np.int32)], False, (15, 15, 15), max(1, unit // 400))
+
+    for _ in range(regions):
+        x, y = int(rng.uniform(0.05, 0.7) * w), int(rng.uniform(0.05, 0.7) * h)
+        bw, bh = int(unit * rng.uniform(0.08, 0.15)), int(unit * rng.uniform(0.08, 0.15))
+        cv2.rectangle(out, (x, y), (x + bw, y + bh), (200, 200, 60), -1)
+
+    M = np.float32([[1, 0, shift[0] * w / 640], [0, 1, shift[1] * h / 480]])
+    return cv2.warpAffine(out, M, (w, h), borderMode=cv2.BORDER_REFLECT)
+
+
+# =========================================================
+# MEASUREMENT
+# =========================================================
+def measure(fn, repeats, setup=None):
+    """
+    Run fn repeats times; returns timing stats (ms) and the
+    peak traced allocation (numpy / OpenCV output arrays) in MB.
+    setup() builds fresh arguments so cached planes are not reused.
+    Memory is traced in one extra, untimed run: tracemalloc slows
+    Python-heavy stages down and would skew the timings.
+    """
+    times = []
+
+    for _ in range(repeats):
+        args = setup() if setup else ()
+
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append((time.perf_counter() - t0) * 1000)
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times.sort()
+    return {
+        "repeats": repeats,
+        "min_ms": round(times[0], 3),
+        "median_ms": round(times[len(times) // 2], 3),
+        "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+        "peak_mem_mb": round(peak / (1024 * 1024), 3),
+    }
+
+
+def bench_pair(before, after, workdir, repeats):
+    """Time every stage on one synthesized pair"""
+    before_n = normalize_size(before)
+    h, w = before_n.shape[:2]
+    after_n = cv2.resize(after, (w, h))
+
+    def contexts():
+        return ImageContext(before_n), ImageContext(after_n)
+
+    def one_context():
+        return (ImageContext(after_n),)
+
+    def ssim_all(b, a):
+        engine = SSIMEngine(b, a)
+        engine.score("equalized")
+        return engine
+
+    def diff_mask(b, a):
+        return create_advanced_diff_mask(b.gray, a.gray, engine=SSIMEngine(b, a))
+
+    mask, diff_ssim = diff_mask(*contexts())
+
+    def contours():
+        return cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    def writes():
+        # the engine's writer (JPEG_QUALITY, write mode); flush so
+        # background encodes are inside the measurement
+        artifacts.write_jpeg(os.path.join(workdir, "w_heatmap.jpg"),
+                             cv2.applyColorMap(diff_ssim, cv2.COLORMAP_JET))
+        artifacts.write_jpeg(os.path.join(workdir, "w_mask.jpg"),
+                             cv2.applyColorMap(mask, cv2.COLORMAP_HOT))
+        artifacts.write_jpeg(os.path.join(workdir, "w_comparison.jpg"),
+                             np.hstack([before_n, after_n]))
+        artifacts.write_jpeg(os.path.join(workdir, "w_annotated.jpg"), after_n)
+        artifacts.flush()
+
+    before_path = os.path.join(workdir, "before.jpg")
+    after_path = os.path.join(workdir, "after.jpg")
+    cv2.imwrite(before_path, before)
+    cv2.imwrite(after_path, after)
+    out_path = os.path.join(workdir, "annotated.jpg")
+
+    fast_path = {}
+
+    def end_to_end():
+        result = compare_images(before_path, after_path, out_path)
+        # a pair is done when its artifacts are on disk (background writes)
+        artifacts.flush()
+        fast_path["hit"] = result["fast_path"]
+
+    stages = {
+        "align_images": measure(lambda b, a: align_images(b, a), repeats, contexts),
+        "enhanced_rust_score": measure(enhanced_rust_score, repeats, one_context),
+        "detect_cracks_and_damage": measure(detect_cracks_and_damage, repeats, one_context),
+        "ssim": measure(ssim_all, repeats, contexts),
+        "diff_mask": measure(diff_mask, repeats, contexts),
+        "contours": measure(contours, repeats),
+        "image_writes": measure(writes, repeats),
+        "compare_images": measure(end_to_end, repeats),
+    }
+
+    e2e = stages["compare_images"]["median_ms"]
+    return {
+        "engine_size": [w, h],
+        "fast_path": fast_path.get("hit", False),
+        "throughput_pairs_per_s": round(1000.0 / e2e, 3) if e2e else None,
+        "stages": stages,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(resolutions, levels, repeats):
+    cv2.setNumThreads(1)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "engine_version": image_diff.ENGINE_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "ssim_backend": image_diff.SSIM_BACKEND,
+            "align_level": image_diff.ALIGN_LEVEL,
+            "align_refine": image_diff.ALIGN_REFINE,
+            "align_refine_level": image_diff.ALIGN_REFINE_LEVEL,
+            "align_matcher": image_diff.ALIGN_MATCHER,
+            "fast_path_threshold": image_diff.FAST_PATH_THRESHOLD,
+            "artifact_write_mode": artifacts.ARTIFACT_WRITE_MODE,
+            "artifacts": list(artifacts.ARTIFACTS),
+            "jpeg_quality": artifacts.JPEG_QUALITY,
+            "repeats": repeats,
+        },
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="imgdiff-bench-") as workdir:
+        for res_name in resolutions:
+            width, height = RESOLUTIONS[res_name]
+            before = synth_pump(width, height)
+
+            for level in levels:
+                after = deteriorate(before, **CHANGE_LEVELS[level])
+                entry = {"resolution": res_name, "size": [width, height], "level": level}
+                entry.update(bench_pair(before, after, workdir, repeats))
+                report["results"].append(entry)
+
+                print(f"{res_name:>5} {level:>6}: "
+                      f"{entry['stages']['compare_images']['median_ms']:9.1f} ms/pair  "
+                      f"({entry['throughput_pairs_per_s']} pairs/s"
+                      f"{', fast path' if entry['fast_path'] else ''})")
+
+    # ru_maxrss is KB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report["peak_rss_mb"] = round(
+        maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1
+    )
+    return report
+
+
+# =========================================================
+# REGRESSION CHECK
+# =========================================================
+def compare_reports(baseline, current, tolerance=0.15):
+    """
+    Per (resolution, level, stage): median time ratio current / baseline.
+    Returns the entries slower than 1 + tolerance.
+    """
+    base = {
+        (r["resolution"], r["level"], stage): s["median_ms"]
+        for r in baseline["results"]
+        for stage, s in r["stages"].items()
+    }
+
+    regressions = []
+    for r in current["results"]:
+        for stage, s in r["stages"].items():
+            before_ms = base.get((r["resolution"], r["level"], stage))
+            if not before_ms:
+                continue
+            ratio = s["median_ms"] / before_ms
+            line = (f"{r['resolution']:>5} {r['level']:>6} {stage:<26} "
+                    f"{before_ms:9.2f} -> {s['median_ms']:9.2f} ms  x{ratio:.2f}")
+            if ratio > 1 + tolerance:
+                regressions.append(line)
+                print("❌ " + line)
+            else:
+                print("   " + line)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the image_diff engine')
+    parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS),
+                        choices=list(RESOLUTIONS))
+    parser.add_argument('--levels', nargs='+', default=list(CHANGE_LEVELS),
+                        choices=list(CHANGE_LEVELS))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default=None,
+                        help='JSON file (default: benchmarks/bench_<timestamp>.json)')
+    parser.add_argument('--compare', default=None,
+                        help='Baseline JSON; exit 1 if any stage is slower than tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed slowdown per stage (default: 0.15 = 15%%)')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.resolutions, args.levels, args.repeats)
+
+    output = args.output or os.path.join(
+        "benchmarks", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nPeak RSS: {report['peak_rss_mb']} MB")
+    print(f"✅ Results saved: {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nComparing against {args.compare} "
+              f"(commit {baseline.get('commit')}):")
+        regressions = compare_reports(baseline, report, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed more than "
+                  f"{args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
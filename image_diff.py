@@ -1,15 +1,234 @@
+import os
+from functools import cached_property
+
 import cv2
 import numpy as np
 from skimage.metrics import structural_similarity as ssim
 from scipy import ndimage
 
+from caching import get_feature_cache
+from timing import StageTimer
+from artifacts import write_jpeg, wants, ARTIFACTS, JPEG_QUALITY
+
+
+# "skimage" (reference) or "opencv" (separable box-filter SSIM)
+SSIM_BACKEND = os.getenv("SSIM_BACKEND", "skimage")
+
+# size normalization (width) applied to both images
+MAX_W = 800
+
+# thumbnail SSIM at or above this skips the full engine ("" / 0 disables).
+# Off by default: a 64 px thumbnail averages away thin cracks, so pick a
+# threshold from extras/benchmark.py runs on your own image sets.
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "") or 0)
+FAST_PATH_THUMB_W = 64
+# rust change (percentage points) that still sends a pair to the full engine
+FAST_PATH_MAX_RUST_DELTA = float(os.getenv("FAST_PATH_MAX_RUST_DELTA", 0.5))
+
+# contours smaller than this (pixels) are treated as noise
+MIN_REGION_AREA = 500
+
+# bump when a change alters results for the same inputs (cache keys)
+ENGINE_VERSION = 3
+
+# alignment, "bf" or "flann" (LSH) matching.
+# ALIGN_REFINE=1: coarse-to-fine, ORB on pyramid level ALIGN_LEVEL
+# (default 1) then ECC refinement one level finer. ECC (up to 30
+# iterations) can cost more than the ORB pass it follows, so it is
+# opt-in; without it ORB matches at full resolution (level 0), the
+# original accuracy.
+ALIGN_REFINE = os.getenv("ALIGN_REFINE", "0") == "1"
+ALIGN_LEVEL = int(os.getenv("ALIGN_LEVEL", 1 if ALIGN_REFINE else 0))
+ALIGN_REFINE_LEVEL = int(os.getenv("ALIGN_REFINE_LEVEL", max(ALIGN_LEVEL - 1, 0)))
+ALIGN_MATCHER = os.getenv("ALIGN_MATCHER", "bf")
+# minimum correlation to accept a reused homography (checked on a
+# half-resolution warp, no ECC unless ALIGN_REFINE)
+ALIGN_REUSE_MIN_CC = float(os.getenv("ALIGN_REUSE_MIN_CC", 0.7))
+
+# extra scales are cheap: they come from the shared gray pyramid
+MULTISCALE_SCALES = [
+    float(x) for x in os.getenv("MULTISCALE_SCALES", "1.0,0.5,0.25").split(",")
+]
+
+
+# =========================================================
+# WORKER INIT (process pool)
+# =========================================================
+def init_worker():
+    """Keep each pool process on one OpenCV thread to avoid oversubscription"""
+    cv2.setNumThreads(1)
+
+
+# =========================================================
+# PER-IMAGE ANALYSIS CONTEXT
+# Derived planes are computed lazily, once, and shared
+# by every helper below
+# =========================================================
+class ImageContext:
+
+    def __init__(self, img):
+        self.img = img
+        self._pyramid = []
+
+    @property
+    def shape(self):
+        return self.img.shape
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+
+    @cached_property
+    def hsv(self):
+        return cv2.cvtColor(self.img, cv2.COLOR_BGR2HSV)
+
+    @cached_property
+    def equalized(self):
+        return cv2.equalizeHist(self.gray)
+
+    @cached_property
+    def laplacian(self):
+        return cv2.Laplacian(self.gray, cv2.CV_64F)
+
+    @cached_property
+    def blurred(self):
+        return cv2.GaussianBlur(self.gray, (5, 5), 0)
+
+    @cached_property
+    def sobel(self):
+        """Gradient magnitude of the blurred gray plane"""
+        grad_x = cv2.Sobel(self.blurred, cv2.CV_32F, 1, 0, ksize=3)
+        grad_y = cv2.Sobel(self.blurred, cv2.CV_32F, 0, 1, ksize=3)
+        return cv2.magnitude(grad_x, grad_y)
+    
+    def pyramid(self, levels):
+        """
+        Gray Gaussian pyramid [full, 1/2, 1/4, ...] with `levels` entries;
+        each level is derived from the previous one via pyrDown and kept.
+        """
+        if not self._pyramid:
+            self._pyramid.append(self.gray)
+        while len(self._pyramid) < levels:
+            self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+        return self._pyramid[:levels]
+    
+    def gray_at_scale(self, scale):
+        """
+        Gray plane at an arbitrary scale (<= 1): exact pyramid levels
+        are returned as-is, other scales are resized from the nearest
+        larger level instead of the full image.
+        """
+        if not 0 < scale <= 1:
+            raise ValueError(f"Scale must be in (0, 1]: {scale}")
+        
+        level = 0
+        while 0.5 ** (level + 1) >= scale:
+            level += 1
+        base = self.pyramid(level + 1)[level]
+        
+        if scale == 0.5 ** level:
+            return base
+        
+        h, w = self.shape[:2]
+        return cv2.resize(
+            base, (int(w * scale), int(h * scale)),
+            interpolation=cv2.INTER_AREA
+        )
+
+
+def as_context(img):
+    """Helpers accept either a BGR array or an ImageContext"""
+    return img if isinstance(img, ImageContext) else ImageContext(img)
+
+
+# =========================================================
+# SSIM ENGINE
+# =========================================================
+def _ssim_opencv(img1, img2, win_size=7, K1=0.01, K2=0.03, data_range=255):
+    """
+    NumPy/OpenCV SSIM matching skimage's defaults
+    (7x7 uniform window, sample covariance, reflect borders)
+    """
+    a = img1.astype(np.float64)
+    b = img2.astype(np.float64)
+    
+    def mean(x):
+        return cv2.boxFilter(
+            x, -1, (win_size, win_size),
+            normalize=True, borderType=cv2.BORDER_REFLECT
+        )
+    
+    NP = win_size ** 2
+    cov_norm = NP / (NP - 1)
+    
+    ux, uy = mean(a), mean(b)
+    uxx, uyy, uxy = mean(a * a), mean(b * b), mean(a * b)
+    
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+    
+    C1 = (K1 * data_range) ** 2
+    C2 = (K2 * data_range) ** 2
+    
+    S = ((2 * ux * uy + C1) * (2 * vxy + C2)) / (
+        (ux ** 2 + uy ** 2 + C1) * (vx + vy + C2)
+    )
+    
+    # ignore the filter border when averaging, as skimage does
+    pad = (win_size - 1) // 2
+    mssim = S[pad:-pad, pad:-pad].mean()
+    
+    return float(mssim), S
+
+
+def ssim_full(img1, img2, backend=None):
+    """Return (score, full SSIM map) for two gray images"""
+    backend = backend or SSIM_BACKEND
+    
+    if backend == "opencv":
+        return _ssim_opencv(img1, img2)
+    if backend == "skimage":
+        score, S = ssim(img1, img2, full=True)
+        return float(score), S
+    
+    raise ValueError(f"Unknown SSIM backend: {backend}")
+
+
+class SSIMEngine:
+    """
+    Computes the SSIM map of a pair once per preprocessing
+    ("gray", "equalized") and serves score / map from it.
+    """
+    
+    def __init__(self, ctx1, ctx2, backend=None):
+        self.ctx1 = as_context(ctx1)
+        self.ctx2 = as_context(ctx2)
+        self.backend = backend
+        self._cache = {}
+    
+    def full(self, plane="gray"):
+        if plane not in self._cache:
+            self._cache[plane] = ssim_full(
+                getattr(self.ctx1, plane),
+                getattr(self.ctx2, plane),
+                self.backend
+            )
+        return self._cache[plane]
+    
+    def score(self, plane="gray"):
+        return self.full(plane)[0]
+    
+    def diff_map(self, plane="gray"):
+        """Dissimilarity as uint8 (255 = completely different)"""
+        return ((1 - self.full(plane)[1]) * 255).astype("uint8")
+
 
 # =========================================================
 # HELPER — Brightness Score
 # =========================================================
 def image_brightness_score(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    return gray.mean()
+    return as_context(img).gray.mean()
 
 
 # =========================================================
@@ -17,14 +236,14 @@ def image_brightness_score(img):
 # =========================================================
 def image_quality_metrics(img):
     """Compute contrast, sharpness, and texture entropy"""
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    ctx = as_context(img)
+    gray = ctx.gray
     
     # Contrast (standard deviation)
     contrast = gray.std()
     
     # Sharpness (Laplacian variance)
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    sharpness = laplacian.var()
+    sharpness = ctx.laplacian.var()
     
     # Texture entropy
     hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
@@ -49,7 +268,8 @@ def enhanced_rust_score(img):
     - Multiple HSV ranges (rust, orange, brown)
     - Texture analysis for corroded surfaces
     """
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    ctx = as_context(img)
+    hsv = ctx.hsv
     
     # Multiple rust color ranges
     rust_ranges = [
@@ -68,7 +288,7 @@ def enhanced_rust_score(img):
         combined_mask = cv2.bitwise_or(combined_mask, mask)
     
     # Texture-based corrosion detection
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = ctx.gray
     
     # High-frequency texture (rough surfaces)
     kernel = np.array([[-1, -1, -1],
@@ -89,6 +309,28 @@ def enhanced_rust_score(img):
     }
 
 
+# =========================================================
+# HELPER — Region Ratios via Integral Images
+# =========================================================
+def mask_integral(mask):
+    """Summed-area table of a binary mask (counts of set pixels)"""
+    return cv2.integral((mask > 0).astype(np.uint8))
+
+
+def region_ratio(integral, x, y, w, h):
+    """Fraction of set pixels inside a box, in O(1)"""
+    if w <= 0 or h <= 0:
+        return 0.0
+    
+    count = (
+        integral[y + h, x + w]
+        - integral[y, x + w]
+        - integral[y + h, x]
+        + integral[y, x]
+    )
+    return count / float(w * h)
+
+
 # =========================================================
 # HELPER — Crack/Damage Detection
 # =========================================================
@@ -99,7 +341,7 @@ def detect_cracks_and_damage(img):
     - Hough line detection for cracks
     - Morphological operations for damage patterns
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = as_context(img).gray
     
     # Enhanced edge detection
     edges = cv2.Canny(gray, 50, 150, apertureSize=3)
@@ -138,51 +380,192 @@ def detect_cracks_and_damage(img):
 # =========================================================
 # HELPER — Image Alignment (Feature-based)
 # =========================================================
-def align_images(img1, img2, max_features=500):
+def orb_features(img, max_features=500, level=0):
     """
-    Align images using ORB feature matching
-    Corrects for slight camera movements or angle differences
+    ORB keypoint coordinates (Nx2 float32) and descriptors,
+    detected on gray pyramid level `level` (coordinates of that level)
     """
-    # Convert to grayscale
-    gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
+    gray = as_context(img).pyramid(level + 1)[level]
     
-    # Detect ORB features
     orb = cv2.ORB_create(max_features)
-    kp1, desc1 = orb.detectAndCompute(gray1, None)
-    kp2, desc2 = orb.detectAndCompute(gray2, None)
+    kp, desc = orb.detectAndCompute(gray, None)
     
-    if desc1 is None or desc2 is None:
-        return img2, False
+    if not kp:
+        return np.empty((0, 2), dtype=np.float32), None
+    return cv2.KeyPoint_convert(kp), desc
+
+
+def _knn_matcher(name):
+    if name == "flann":
+        # FLANN with an LSH index for binary (ORB) descriptors
+        index_params = dict(
+            algorithm=6,  # FLANN_INDEX_LSH
+            table_number=6,
+            key_size=12,
+            multi_probe_level=1
+        )
+        return cv2.FlannBasedMatcher(index_params, dict(checks=50))
+    return cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+
+
+def _match_points(kp1, desc1, kp2, desc2, matcher=ALIGN_MATCHER):
+    """Lowe-filtered matched point arrays (pts1, pts2)"""
+    matches = _knn_matcher(matcher).knnMatch(desc1, desc2, k=2)
+    
+    # (queryIdx, trainIdx, best, second best) -> vectorized ratio test
+    table = np.array(
+        [
+            (m[0].queryIdx, m[0].trainIdx, m[0].distance, m[1].distance)
+            for m in matches if len(m) == 2
+        ],
+        dtype=np.float64
+    ).reshape(-1, 4)
+    
+    good = table[table[:, 2] < 0.75 * table[:, 3]]
+    
+    return kp1[good[:, 0].astype(int)], kp2[good[:, 1].astype(int)]
+
+
+def _level_scale(ctx, level):
+    """(sx, sy) from full resolution to pyramid level coordinates"""
+    h, w = ctx.shape[:2]
+    lh, lw = ctx.pyramid(level + 1)[level].shape[:2]
+    return lw / w, lh / h
+
+
+def _rescale_homography(H, sx, sy):
+    """Express a homography in coordinates scaled by (sx, sy)"""
+    S = np.diag([sx, sy, 1.0])
+    return S @ H @ np.linalg.inv(S)
+
+
+def _refine_homography(ctx1, ctx2, H, level):
+    """
+    ECC refinement of an after->before homography on a pyramid level.
+    Returns (H, correlation) or (None, 0.0) if ECC does not converge.
+    """
+    sx, sy = _level_scale(ctx1, level)
+    gray1 = ctx1.pyramid(level + 1)[level]
+    gray2 = ctx2.pyramid(level + 1)[level]
+    
+    # ECC warps template coords into input coords (before -> after)
+    warp = np.linalg.inv(_rescale_homography(H, sx, sy)).astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 1e-4)
+    
+    try:
+        cc, warp = cv2.findTransformECC(
+            gray1, gray2, warp, cv2.MOTION_HOMOGRAPHY, criteria, None, 5
+        )
+    except cv2.error:
+        return None, 0.0
+    
+    H = _rescale_homography(np.linalg.inv(warp), 1 / sx, 1 / sy)
+    return H, float(cc)
+
+
+def _homography_cc(ctx1, ctx2, H, level=1):
+    """
+    Correlation of the before image with the after image warped by an
+    after->before homography, on a pyramid level (one warp, no iterations)
+    """
+    sx, sy = _level_scale(ctx1, level)
+    gray1 = ctx1.pyramid(level + 1)[level]
+    gray2 = ctx2.pyramid(level + 1)[level]
+    
+    warped = cv2.warpPerspective(
+        gray2, _rescale_homography(H, sx, sy), (gray1.shape[1], gray1.shape[0])
+    )
+    return float(cv2.matchTemplate(gray1, warped, cv2.TM_CCOEFF_NORMED)[0][0])
+
+
+def estimate_homography(img1, img2, max_features=500, ref_features=None,
+                        level=ALIGN_LEVEL, matcher=ALIGN_MATCHER):
+    """
+    after->before homography from ORB matches on pyramid level `level`,
+    returned in full-resolution coordinates (None if not enough matches)
+    """
+    ctx1 = as_context(img1)
+    ctx2 = as_context(img2)
+    
+    if ref_features is None:
+        ref_features = orb_features(ctx1, max_features, level)
+    kp1, desc1 = ref_features
+    kp2, desc2 = orb_features(ctx2, max_features, level)
     
-    # Match features
-    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
-    matches = matcher.knnMatch(desc1, desc2, k=2)
+    if desc1 is None or desc2 is None or len(desc2) < 2:
+        return None
     
-    # Apply Lowe's ratio test
-    good_matches = []
-    for m_n in matches:
-        if len(m_n) == 2:
-            m, n = m_n
-            if m.distance < 0.75 * n.distance:
-                good_matches.append(m)
+    pts1, pts2 = _match_points(kp1, desc1, kp2, desc2, matcher)
     
     # Need at least 10 good matches
-    if len(good_matches) < 10:
-        return img2, False
+    if len(pts1) < 10:
+        return None
     
-    # Extract matched keypoints
-    pts1 = np.float32([kp1[m.queryIdx].pt for m in good_matches])
-    pts2 = np.float32([kp2[m.trainIdx].pt for m in good_matches])
+    # RANSAC threshold of 5 px at full resolution
+    H, mask = cv2.findHomography(
+        pts2, pts1, cv2.RANSAC, max(5.0 * 0.5 ** level, 1.0)
+    )
+    if H is None:
+        return None
+    
+    sx, sy = _level_scale(ctx1, level)
+    return _rescale_homography(H, 1 / sx, 1 / sy)
+
+
+def align_images(img1, img2, max_features=500, ref_features=None,
+                 homography_key=None):
+    """
+    Align images using ORB feature matching
+    Corrects for slight camera movements or angle differences
+    - matching on pyramid level ALIGN_LEVEL, then (ALIGN_REFINE)
+      ECC refinement on ALIGN_REFINE_LEVEL
+    - ref_features: precomputed orb_features(img1) at ALIGN_LEVEL
+    - homography_key: e.g. "<asset>:<camera position>"; the last good
+      homography for that key is tried before matching (validated by
+      a single warp, refined only with ALIGN_REFINE)
+    """
+    ctx1 = as_context(img1)
+    ctx2 = as_context(img2)
+    img2 = ctx2.img
+    h, w = ctx1.shape[:2]
+    
+    refine_level = ALIGN_REFINE_LEVEL
+    
+    cache = get_feature_cache()
+    cache_key = (
+        cache.key(homography_key, "homography", engine_params())
+        if homography_key else None
+    )
     
-    # Find homography
-    H, mask = cv2.findHomography(pts2, pts1, cv2.RANSAC, 5.0)
+    # ---------- Reuse the homography of this camera position ----------
+    if cache_key is not None:
+        cached_H = cache.get(cache_key)
+        if cached_H is not None:
+            if ALIGN_REFINE:
+                H, cc = _refine_homography(ctx1, ctx2, cached_H, refine_level)
+            else:
+                H, cc = cached_H, _homography_cc(ctx1, ctx2, cached_H)
+            if H is not None and cc >= ALIGN_REUSE_MIN_CC:
+                if H is not cached_H:
+                    cache.put(cache_key, H)
+                return cv2.warpPerspective(img2, H, (w, h)), True
+    
+    # ---------- Coarse: feature matching on a pyramid level ----------
+    H = estimate_homography(ctx1, ctx2, max_features, ref_features)
     
     if H is None:
         return img2, False
     
+    # ---------- Fine: ECC refinement ----------
+    if ALIGN_REFINE:
+        refined, cc = _refine_homography(ctx1, ctx2, H, refine_level)
+        if refined is not None:
+            H = refined
+    
+    if cache_key is not None:
+        cache.put(cache_key, H)
+    
     # Warp image
-    h, w = img1.shape[:2]
     aligned = cv2.warpPerspective(img2, H, (w, h))
     
     return aligned, True
@@ -191,23 +574,29 @@ def align_images(img1, img2, max_features=500):
 # =========================================================
 # HELPER — Multi-Scale Analysis
 # =========================================================
-def multiscale_comparison(img1, img2, scales=[1.0, 0.5, 0.25]):
+def multiscale_comparison(img1, img2, scales=[1.0, 0.5, 0.25], engine=None):
     """
     Compare images at multiple scales to detect both large and small changes
     """
     scores = []
+    ctx1 = as_context(img1)
+    ctx2 = as_context(img2)
     
     for scale in scales:
-        h, w = img1.shape[:2]
-        new_h, new_w = int(h * scale), int(w * scale)
+        # full resolution is the gray SSIM the engine already holds
+        if scale == 1.0 and engine is not None:
+            scores.append({'scale': scale, 'similarity': engine.score("gray")})
+            continue
         
-        img1_scaled = cv2.resize(img1, (new_w, new_h))
-        img2_scaled = cv2.resize(img2, (new_w, new_h))
+        # gray pyramid levels, built once per image and shared
+        gray1 = ctx1.gray_at_scale(scale)
+        gray2 = ctx2.gray_at_scale(scale)
         
-        gray1 = cv2.cvtColor(img1_scaled, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(img2_scaled, cv2.COLOR_BGR2GRAY)
+        # too small for a 7x7 SSIM window
+        if min(gray1.shape[:2]) < 7:
+            continue
         
-        score = ssim(gray1, gray2)
+        score, _ = ssim_full(gray1, gray2, engine.backend if engine else None)
         scores.append({'scale': scale, 'similarity': float(score)})
     
     return scores
@@ -216,7 +605,7 @@ def multiscale_comparison(img1, img2, scales=[1.0, 0.5, 0.25]):
 # =========================================================
 # HELPER — Advanced Difference Highlighting
 # =========================================================
-def create_advanced_diff_mask(before_gray, after_gray):
+def create_advanced_diff_mask(before_gray, after_gray, engine=None):
     """
     Enhanced difference detection using:
     - Adaptive thresholding
@@ -226,9 +615,12 @@ def create_advanced_diff_mask(before_gray, after_gray):
     # Method 1: Absolute difference
     diff_abs = cv2.absdiff(before_gray, after_gray)
     
-    # Method 2: SSIM-based difference
-    _, diff_ssim = ssim(before_gray, after_gray, full=True)
-    diff_ssim = ((1 - diff_ssim) * 255).astype("uint8")
+    # Method 2: SSIM-based difference (reuses the engine's gray map)
+    if engine is not None:
+        diff_ssim = engine.diff_map("gray")
+    else:
+        _, diff_ssim = ssim_full(before_gray, after_gray)
+        diff_ssim = ((1 - diff_ssim) * 255).astype("uint8")
     
     # Method 3: Adaptive threshold on difference
     diff_adaptive = cv2.adaptiveThreshold(
@@ -257,13 +649,7 @@ def create_advanced_diff_mask(before_gray, after_gray):
 # HELPER — Structure Heatmap
 # =========================================================
 def structure_heatmap(img, out_path):
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    grad_x = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
-    
-    magnitude = cv2.magnitude(grad_x, grad_y)
+    magnitude = as_context(img).sobel
     
     mag_norm = cv2.normalize(
         magnitude, None, 0, 255, cv2.NORM_MINMAX
@@ -271,8 +657,7 @@ def structure_heatmap(img, out_path):
     
     heat = cv2.applyColorMap(mag_norm, cv2.COLORMAP_TURBO)
     
-    cv2.imwrite(out_path, heat)
-    return out_path
+    return write_jpeg(out_path, heat)
 
 
 # =========================================================
@@ -318,7 +703,182 @@ def classify_change_significance(zone_data, metrics):
 # =========================================================
 # MAIN — ENHANCED IMAGE COMPARISON ENGINE
 # =========================================================
-def compare_images(before_path, after_path, out_path, enable_alignment=True):
+def decode_image(data):
+    """Decode encoded image bytes (upload body) into a BGR array"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+# =========================================================
+# ENGINE PARAMETERS (everything that changes the result)
+# =========================================================
+def engine_params(enable_alignment=True):
+    return {
+        "version": ENGINE_VERSION,
+        "enable_alignment": enable_alignment,
+        "max_w": MAX_W,
+        "min_region_area": MIN_REGION_AREA,
+        "fast_path_threshold": FAST_PATH_THRESHOLD,
+        "fast_path_max_rust_delta": FAST_PATH_MAX_RUST_DELTA,
+        "align_level": ALIGN_LEVEL,
+        "align_refine": ALIGN_REFINE,
+        "align_refine_level": ALIGN_REFINE_LEVEL,
+        "align_matcher": ALIGN_MATCHER,
+        "ssim_backend": SSIM_BACKEND,
+        "multiscale_scales": MULTISCALE_SCALES,
+        "artifacts": sorted(ARTIFACTS),
+        "jpeg_quality": JPEG_QUALITY,
+    }
+
+
+# =========================================================
+# REFERENCE ("BEFORE") FEATURES — Per-image, cacheable
+# =========================================================
+def analyze_reference(img, heatmap_path=None, max_features=500):
+    """
+    Everything compare_images needs from the size-normalized
+    "before" image that does not depend on the "after" image.
+    """
+    ctx = as_context(img)
+    
+    orb_pts, orb_desc = orb_features(ctx, max_features, ALIGN_LEVEL)
+    rust = enhanced_rust_score(ctx)
+    damage = detect_cracks_and_damage(ctx)
+    
+    features = {
+        "shape": tuple(ctx.shape[:2]),
+        "orb_points": orb_pts,
+        "orb_descriptors": orb_desc,
+        "quality": image_quality_metrics(ctx),
+        "brightness": float(image_brightness_score(ctx)),
+        "rust_ratio": float(rust['rust_ratio']),
+        "rust_mask": rust['rust_mask'],
+        "crack_count": damage['crack_count'],
+        "damage_ratio": float(damage['damage_ratio']),
+        "heatmap_path": None,
+    }
+    
+    if heatmap_path:
+        features["heatmap_path"] = structure_heatmap(ctx, heatmap_path)
+    
+    return features
+
+
+def normalize_size(img):
+    """Downscale to at most MAX_W wide (the engine's working size)"""
+    h, w = img.shape[:2]
+    
+    if w > MAX_W:
+        scale = MAX_W / w
+        img = cv2.resize(img, (int(w*scale), int(h*scale)))
+    
+    return img
+
+
+def normalize_pair(before, after):
+    """before at the working size, after resized to match it"""
+    before = normalize_size(before)
+    h, w = before.shape[:2]
+    return before, cv2.resize(after, (w, h))
+
+
+def reference_cache_key(before_digest):
+    return get_feature_cache().key(before_digest, "reference", engine_params())
+
+
+def reference_features(before_ctx, before_digest, heatmap_path):
+    """analyze_reference through the per-image feature cache"""
+    cache = get_feature_cache()
+    key = reference_cache_key(before_digest)
+    
+    features = cache.get(key)
+    if features is None or features["shape"] != tuple(before_ctx.shape[:2]):
+        features = analyze_reference(before_ctx, heatmap_path)
+        cache.put(key, features)
+    
+    elif heatmap_path and not (
+        features["heatmap_path"] and os.path.exists(features["heatmap_path"])
+    ):
+        # artifact was cleaned up, everything else is still valid
+        features = dict(features)
+        features["heatmap_path"] = structure_heatmap(before_ctx, heatmap_path)
+        cache.put(key, features)
+    
+    return features
+
+
+# =========================================================
+# FAST PATH — Near-identical pairs
+# =========================================================
+def quick_similarity(img1, img2, thumb_w=FAST_PATH_THUMB_W):
+    """Cheap SSIM on small gray thumbnails (a few milliseconds)"""
+    ctx1 = as_context(img1)
+    ctx2 = as_context(img2)
+    
+    h, w = ctx1.shape[:2]
+    size = (thumb_w, max(7, int(h * thumb_w / w)))
+    
+    thumb1 = cv2.resize(ctx1.gray, size, interpolation=cv2.INTER_AREA)
+    thumb2 = cv2.resize(ctx2.gray, size, interpolation=cv2.INTER_AREA)
+    
+    score, _ = ssim_full(thumb1, thumb2)
+    return score
+
+
+def _no_change_result(before_ctx, after_ctx, score, out_path):
+    """
+    Minimal "no significant change" result with the same keys as
+    the full engine; only the annotated image is written.
+    None when the rust coverage moved by more than
+    FAST_PATH_MAX_RUST_DELTA (small patches vanish in the thumbnail).
+    """
+    before_rust = enhanced_rust_score(before_ctx)['rust_ratio']
+    after_rust = enhanced_rust_score(after_ctx)['rust_ratio']
+    if abs(after_rust - before_rust) * 100 > FAST_PATH_MAX_RUST_DELTA:
+        return None
+    
+    before_metrics = image_quality_metrics(before_ctx)
+    after_metrics = image_quality_metrics(after_ctx)
+    
+    annotated_path = None
+    if wants("annotated"):
+        annotated_path = write_jpeg(out_path, after_ctx.img)
+    
+    return {
+        "similarity": float(score),
+        "change_percent": float((1 - score) * 100),
+        "regions": 0,
+
+        "before_brightness": float(image_brightness_score(before_ctx)),
+        "after_brightness": float(image_brightness_score(after_ctx)),
+
+        "before_rust_pct": float(before_rust * 100),
+        "after_rust_pct": float(after_rust * 100),
+        "rust_delta_pct": float((after_rust - before_rust) * 100),
+
+        "zones": [],
+        "zone_severity": {},
+        "zone_parts": {},
+        "zone_boxes": {},
+
+        "annotated_path": annotated_path,
+        "heatmap_path": None,
+        "before_heatmap_path": None,
+
+        "alignment_success": False,
+        "multiscale_similarity": [],
+        "contrast_delta": float(after_metrics['contrast'] - before_metrics['contrast']),
+        "sharpness_delta": float(after_metrics['sharpness'] - before_metrics['sharpness']),
+        "crack_delta": 0,
+        "diff_mask_path": None,
+        "comparison_path": None,
+        "zone_details": {},
+        "fast_path": True
+    }
+
+
+def compare_images(before_path, after_path, out_path, enable_alignment=True,
+                   before_digest=None, homography_key=None, timer=None):
     """
     Enhanced image comparison with:
     - Feature-based alignment
@@ -326,99 +886,177 @@ def compare_images(before_path, after_path, out_path, enable_alignment=True):
     - Advanced defect detection
     - Multi-scale analysis
     - Comprehensive metrics
+    Per-stage wall / CPU times are returned under "timings".
     """
+    timer = timer or StageTimer()
     
     # ---------- Load images ----------
     before = cv2.imread(before_path)
     after = cv2.imread(after_path)
+    timer.lap("decode")
     
+    return compare_image_arrays(
+        before, after, out_path, enable_alignment,
+        before_digest=before_digest, homography_key=homography_key,
+        timer=timer
+    )
+
+
+def compare_image_arrays(before, after, out_path, enable_alignment=True,
+                         fast_path_threshold=FAST_PATH_THRESHOLD,
+                         before_digest=None, homography_key=None, timer=None):
+    """
+    Same as compare_images, for images that are already decoded
+    (BGR numpy arrays), e.g. straight from an upload.
+    Pairs whose thumbnail SSIM reaches fast_path_threshold skip the
+    full engine (None / 0 disables the pre-check).
+    before_digest (sha256 of the before image's bytes) enables the
+    per-image feature cache, so a baseline is only analyzed once.
+    homography_key (asset + camera position) reuses the last alignment
+    (per baseline image when before_digest is given).
+    """
     if before is None or after is None:
         raise ValueError("One of the images could not be read")
     
-    # ---------- Size normalization ----------
-    MAX_W = 800
-    h, w = before.shape[:2]
+    timer = timer or StageTimer()
     
-    if w > MAX_W:
-        scale = MAX_W / w
-        before = cv2.resize(before, (int(w*scale), int(h*scale)))
+    # ---------- Size normalization ----------
+    before, after = normalize_pair(before, after)
+    
+    # ---------- Shared per-image planes (gray, HSV, ...) ----------
+    before_ctx = ImageContext(before)
+    after_ctx = ImageContext(after)
+    timer.lap("resize")
+    
+    # ---------- Fast path: essentially unchanged pair ----------
+    if fast_path_threshold:
+        quick_score = quick_similarity(before_ctx, after_ctx)
+        timer.lap("fast_path")
+        if quick_score >= fast_path_threshold:
+            result = _no_change_result(before_ctx, after_ctx, quick_score, out_path)
+            timer.lap("fast_path")
+            if result is not None:
+                result["timings"] = timer.to_dict()
+                return result
+    
+    # ---------- Reference ("before") features, cached per image ----------
+    before_heatmap_path = (
+        out_path.replace(".jpg", "_before_heatmap.jpg")
+        if wants("before_heatmap") else None
+    )
     
-    h, w = before.shape[:2]
-    after = cv2.resize(after, (w, h))
+    if before_digest is not None:
+        ref = reference_features(before_ctx, before_digest, before_heatmap_path)
+    else:
+        ref = analyze_reference(before_ctx, before_heatmap_path)
+    timer.lap("reference")
     
     # ---------- Image Alignment ----------
     aligned = after
     alignment_success = False
     
+    # a re-registered baseline must not start from the old transform
+    if homography_key and before_digest:
+        homography_key = f"{homography_key}:{before_digest}"
+    
     if enable_alignment:
-        aligned, alignment_success = align_images(before, after)
+        aligned, alignment_success = align_images(
+            before_ctx, after_ctx,
+            ref_features=(ref["orb_points"], ref["orb_descriptors"]),
+            homography_key=homography_key
+        )
         if not alignment_success:
             print("Warning: Image alignment failed, using unaligned images")
             aligned = after
     
+    # unaligned -> keep the planes already derived for "after"
+    aligned_ctx = after_ctx if aligned is after else ImageContext(aligned)
+    timer.lap("align")
+    
     # ---------- Grayscale conversion ----------
-    before_gray = cv2.cvtColor(before, cv2.COLOR_BGR2GRAY)
-    after_gray = cv2.cvtColor(aligned, cv2.COLOR_BGR2GRAY)
+    before_gray = before_ctx.gray
+    after_gray = aligned_ctx.gray
     
     # ---------- Histogram equalization for better comparison ----------
-    before_eq = cv2.equalizeHist(before_gray)
-    after_eq = cv2.equalizeHist(after_gray)
+    before_eq = before_ctx.equalized
+    after_eq = aligned_ctx.equalized
     
     # =====================================================
     # CONDITION METRICS
     # =====================================================
-    before_metrics = image_quality_metrics(before)
-    after_metrics = image_quality_metrics(aligned)
+    before_metrics = ref["quality"]
+    after_metrics = image_quality_metrics(aligned_ctx)
     
-    before_brightness = image_brightness_score(before)
-    after_brightness = image_brightness_score(aligned)
+    before_brightness = ref["brightness"]
+    after_brightness = image_brightness_score(aligned_ctx)
     
     # Enhanced rust detection
-    before_rust_data = enhanced_rust_score(before)
-    after_rust_data = enhanced_rust_score(aligned)
+    before_rust_data = {
+        'rust_ratio': ref["rust_ratio"],
+        'rust_mask': ref["rust_mask"]
+    }
+    after_rust_data = enhanced_rust_score(aligned_ctx)
     
     # Crack and damage detection
-    before_damage = detect_cracks_and_damage(before)
-    after_damage = detect_cracks_and_damage(aligned)
+    before_damage = {'crack_count': ref["crack_count"]}
+    after_damage = detect_cracks_and_damage(aligned_ctx)
+    timer.lap("metrics")
     
     # =====================================================
     # MULTI-SCALE COMPARISON
     # =====================================================
-    multiscale_results = multiscale_comparison(before, aligned)
+    # one SSIM map per preprocessing, shared by every stage below
+    ssim_engine = SSIMEngine(before_ctx, aligned_ctx)
+    
+    multiscale_results = multiscale_comparison(
+        before_ctx, aligned_ctx, MULTISCALE_SCALES, engine=ssim_engine
+    )
     
     # =====================================================
     # SSIM COMPARISON (on equalized images for better accuracy)
     # =====================================================
-    score, diff = ssim(before_eq, after_eq, full=True)
-    diff = (diff * 255).astype("uint8")
+    score = ssim_engine.score("equalized")
+    timer.lap("ssim")
     
     # =====================================================
     # ADVANCED DIFFERENCE DETECTION
     # =====================================================
-    diff_mask, diff_ssim = create_advanced_diff_mask(before_gray, after_gray)
+    diff_mask, diff_ssim = create_advanced_diff_mask(
+        before_gray, after_gray, engine=ssim_engine
+    )
+    timer.lap("masks")
     
     # =====================================================
     # VISUALIZATIONS
+    # only the selected artifacts are built; encoding + writing
+    # happens on the artifact writer threads
     # =====================================================
     
-    # Before structure heatmap
-    before_heatmap_path = out_path.replace(".jpg", "_before_heatmap.jpg")
-    structure_heatmap(before, before_heatmap_path)
+    # Before structure heatmap (written with the reference features)
+    before_heatmap_path = ref["heatmap_path"] if wants("before_heatmap") else None
     
     # Difference heatmap
-    heatmap = cv2.applyColorMap(diff_ssim, cv2.COLORMAP_JET)
-    heatmap_path = out_path.replace(".jpg", "_heatmap.jpg")
-    cv2.imwrite(heatmap_path, heatmap)
+    heatmap_path = None
+    if wants("heatmap"):
+        heatmap = cv2.applyColorMap(diff_ssim, cv2.COLORMAP_JET)
+        heatmap_path = write_jpeg(out_path.replace(".jpg", "_heatmap.jpg"), heatmap)
     
     # Enhanced diff mask visualization
-    diff_mask_colored = cv2.applyColorMap(diff_mask, cv2.COLORMAP_HOT)
-    diff_mask_path = out_path.replace(".jpg", "_diff_mask.jpg")
-    cv2.imwrite(diff_mask_path, diff_mask_colored)
+    diff_mask_path = None
+    if wants("diff_mask"):
+        diff_mask_colored = cv2.applyColorMap(diff_mask, cv2.COLORMAP_HOT)
+        diff_mask_path = write_jpeg(
+            out_path.replace(".jpg", "_diff_mask.jpg"), diff_mask_colored
+        )
     
     # Side-by-side comparison
-    comparison = np.hstack([before, aligned])
-    comparison_path = out_path.replace(".jpg", "_comparison.jpg")
-    cv2.imwrite(comparison_path, comparison)
+    comparison_path = None
+    if wants("comparison"):
+        comparison = np.hstack([before, aligned])
+        comparison_path = write_jpeg(
+            out_path.replace(".jpg", "_comparison.jpg"), comparison
+        )
+    timer.lap("writes")
     
     # =====================================================
     # CONTOUR DETECTION & REGION ANALYSIS
@@ -438,6 +1076,10 @@ def compare_images(before_path, after_path, out_path, enable_alignment=True):
     img_h, img_w = aligned.shape[:2]
     total_area = img_w * img_h
     
+    # Summed-area tables of the full-frame rust masks
+    before_rust_integral = mask_integral(before_rust_data['rust_mask'])
+    after_rust_integral = mask_integral(after_rust_data['rust_mask'])
+    
     # Create output image
     output_img = aligned.copy()
     
@@ -445,7 +1087,7 @@ def compare_images(before_path, after_path, out_path, enable_alignment=True):
         area = cv2.contourArea(c)
         
         # Noise filter
-        if area < 500:
+        if area < MIN_REGION_AREA:
             continue
         
         x, y, cw, ch = cv2.boundingRect(c)
@@ -484,13 +1126,9 @@ def compare_images(before_path, after_path, out_path, enable_alignment=True):
         area_percent = (area / total_area) * 100
         severity = min(10, round(area_percent * 10, 2))
         
-        # Extract region for detailed analysis
-        region_before = before[y:y+ch, x:x+cw]
-        region_after = aligned[y:y+ch, x:x+cw]
-        
-        # Region-specific metrics
-        region_rust_before = enhanced_rust_score(region_before)['rust_ratio']
-        region_rust_after = enhanced_rust_score(region_after)['rust_ratio']
+        # Region-specific metrics (O(1) lookups on the full-frame masks)
+        region_rust_before = region_ratio(before_rust_integral, x, y, cw, ch)
+        region_rust_after = region_ratio(after_rust_integral, x, y, cw, ch)
         
         zone_data = {
             "severity": severity,
@@ -519,9 +1157,13 @@ def compare_images(before_path, after_path, out_path, enable_alignment=True):
         )
         
         zone_details[zone] = zone_data
+    timer.lap("contours")
     
     # ---------- Save annotated image ----------
-    cv2.imwrite(out_path, output_img)
+    annotated_path = None
+    if wants("annotated"):
+        annotated_path = write_jpeg(out_path, output_img)
+    timer.lap("writes")
     
     change_percent = (1 - score) * 100
     
@@ -564,6 +1206,7 @@ def compare_images(before_path, after_path, out_path, enable_alignment=True):
         "zone_parts": zone_parts,
         "zone_boxes": zone_boxes,
 
+        "annotated_path": annotated_path,
         "heatmap_path": heatmap_path,
         "before_heatmap_path": before_heatmap_path,
 
@@ -575,7 +1218,9 @@ def compare_images(before_path, after_path, out_path, enable_alignment=True):
         "crack_delta": after_damage['crack_count'] - before_damage['crack_count'],
         "diff_mask_path": diff_mask_path,
         "comparison_path": comparison_path,
-        "zone_details": zone_details  # keep for advanced popup later
+        "zone_details": zone_details,  # keep for advanced popup later
+        "fast_path": False,
+        "timings": timer.to_dict()
     }
 
 
@@ -0,0 +1,365 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from pipeline import run_inspection, build_result_payload
+
+
+# =========================================================
+# CONFIG
+# =========================================================
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", 32))
+
+# empty -> in-memory store: jobs live in one process, so the app must
+# run a single server worker (GET /jobs/{id} on another worker is 404).
+# A SQLite path is shared by every worker and survives restarts.
+JOB_DB = os.getenv("JOB_DB", "")
+
+# a running job's claim expires unless its worker renews it
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", 60))
+# how often idle workers look for jobs queued by other processes
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", 2))
+
+# finished jobs are kept this long / at most this many (memory store)
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 3600))
+JOB_MAX_FINISHED = int(os.getenv("JOB_MAX_FINISHED", 1000))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are waiting (backpressure)"""
+
+
+# =========================================================
+# JOB STORES
+# claim() is the only way a job goes QUEUED -> RUNNING, so a job runs
+# once even when several processes share the store
+# =========================================================
+class MemoryJobStore:
+    """Single process only; finished jobs expire (TTL + size bound)"""
+
+    shared = False
+
+    def __init__(self, ttl=JOB_RESULT_TTL, max_finished=JOB_MAX_FINISHED):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+
+    def connect(self):
+        pass
+
+    def insert(self, job):
+        self.jobs[job["id"]] = job
+
+    def load(self, job_id):
+        return self.jobs.get(job_id)
+
+    def claim(self, job_id, owner, lease_s):
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] != QUEUED:
+            return None
+        job["status"] = RUNNING
+        return job
+
+    def finish(self, job, owner):
+        self.jobs[job["id"]] = job
+        return True
+
+    def renew(self, job_id, owner, lease_s):
+        pass
+
+    def requeue_expired(self):
+        # nothing outlives the process that ran it
+        return []
+
+    def next_queued(self):
+        return None
+
+    def count_queued(self):
+        return sum(1 for j in self.jobs.values() if j["status"] == QUEUED)
+
+    def purge(self):
+        finished = sorted(
+            (j for j in self.jobs.values() if j["status"] in (DONE, FAILED)),
+            key=lambda j: j["finished_at"]
+        )
+        cutoff = time.time() - self.ttl
+        excess = len(finished) - self.max_finished
+        for i, job in enumerate(finished):
+            if i < excess or job["finished_at"] < cutoff:
+                del self.jobs[job["id"]]
+
+
+class SQLiteJobStore:
+    """Shared by every server process on the host"""
+
+    shared = True
+
+    def __init__(self, path, ttl=JOB_RESULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # one connection per process: the app object is created before
+        # a --preload fork, and SQLite connections must not cross it
+        if self._conn is None or self._pid != os.getpid():
+            self.connect()
+        return self._conn
+
+    def connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._pid = os.getpid()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        # databases created before leases existed
+        for column in ("owner TEXT", "lease_until REAL"):
+            try:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        self._conn.commit()
+
+    def insert(self, job):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, status, created_at, data) VALUES (?, ?, ?, ?)",
+                (job["id"], job["status"], job["created_at"], json.dumps(job))
+            )
+            self.conn.commit()
+
+    def finish(self, job, owner):
+        """Store the outcome, only if this worker still holds the job"""
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, owner = NULL, lease_until = NULL "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (job["status"], json.dumps(job), job["id"], owner, RUNNING)
+            )
+            self.conn.commit()
+        return cur.rowcount == 1
+
+    def load(self, job_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data, status FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = json.loads(row[0])
+        # the column is authoritative (claims only update the column)
+        job["status"] = row[1]
+        return job
+
+    def claim(self, job_id, owner, lease_s):
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_until = ? "
+                "WHERE id = ? AND status = ?",
+                (RUNNING, owner, time.time() + lease_s, job_id, QUEUED)
+            )
+            self.conn.commit()
+        return self.load(job_id) if cur.rowcount == 1 else None
+
+    def renew(self, job_id, owner, lease_s):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + lease_s, job_id, owner, RUNNING)
+            )
+            self.conn.commit()
+
+    def requeue_expired(self):
+        """Running jobs whose worker died (lease ran out) -> queued"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id FROM jobs WHERE status = ? "
+                "AND (lease_until IS NULL OR lease_until < ?)",
+                (RUNNING, time.time())
+            ).fetchall()
+            requeued = []
+            for (job_id,) in rows:
+                cur = self.conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL "
+                    "WHERE id = ? AND status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                    (QUEUED, job_id, RUNNING, time.time())
+                )
+                if cur.rowcount == 1:
+                    requeued.append(job_id)
+            self.conn.commit()
+        return requeued
+
+    def next_queued(self):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (QUEUED,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def count_queued(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+
+    def purge(self):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND created_at < ?",
+                (DONE, FAILED, time.time() - self.ttl)
+            )
+            self.conn.commit()
+
+
+# =========================================================
+# QUEUE + WORKER POOL
+# =========================================================
+class JobQueue:
+    """
+    Local inspection job queue.
+    Workers are asyncio tasks; the heavy stages already run
+    on the pipeline executors, so they never block the loop.
+    With a shared store, idle workers also poll it for jobs queued by
+    other processes or left behind by a dead one.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, db_path=JOB_DB):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.store = SQLiteJobStore(db_path) if db_path else MemoryJobStore()
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.queue = None
+        self.tasks = []
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        await asyncio.to_thread(self.store.connect)
+
+        # resume jobs interrupted by a restart (only expired leases:
+        # a sibling worker may be running the others right now)
+        for job_id in await asyncio.to_thread(self.store.requeue_expired):
+            self.queue.put_nowait(job_id)
+
+        self.tasks = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def depth(self):
+        return self.store.count_queued()
+
+    async def submit(self, before_path, after_path, out_path):
+        depth = await asyncio.to_thread(self.depth)
+        if depth >= self.max_pending:
+            raise QueueFull(f"{depth} jobs already pending")
+
+        job = {
+            "id": str(uuid.uuid4()),
+            "status": QUEUED,
+            "created_at": time.time(),
+            "finished_at": None,
+            "before_path": before_path,
+            "after_path": after_path,
+            "out_path": out_path,
+            "result": None,
+            "error": None,
+        }
+        await asyncio.to_thread(self.store.insert, job)
+        self.queue.put_nowait(job["id"])
+        return job
+
+    def get(self, job_id):
+        return self.store.load(job_id)
+
+    async def _next_job_id(self):
+        if not self.store.shared:
+            return await self.queue.get()
+
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=JOB_POLL_S)
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(self.store.requeue_expired)
+            return await asyncio.to_thread(self.store.next_queued)
+
+    async def _worker(self):
+        while True:
+            try:
+                job_id = await self._next_job_id()
+                if job_id is None:
+                    continue
+
+                job = await asyncio.to_thread(
+                    self.store.claim, job_id, self.owner, JOB_LEASE_S
+                )
+            except Exception:
+                # e.g. database locked: try again on the next round
+                traceback.print_exc()
+                await asyncio.sleep(JOB_POLL_S)
+                continue
+
+            if job is None:
+                # taken by another worker / process
+                continue
+            await self._run(job)
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(JOB_LEASE_S / 3)
+            await asyncio.to_thread(self.store.renew, job_id, self.owner, JOB_LEASE_S)
+
+    async def _run(self, job):
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+
+        try:
+            inspection = await run_inspection(
+                job["before_path"], job["after_path"], job["out_path"]
+            )
+            job["result"] = build_result_payload(
+                inspection, job["before_path"], job["after_path"], job["out_path"]
+            )
+            job["status"] = DONE
+        except Exception as e:
+            traceback.print_exc()
+            job["error"] = str(e)
+            job["status"] = FAILED
+        finally:
+            heartbeat.cancel()
+
+        job["finished_at"] = time.time()
+        try:
+            if not await asyncio.to_thread(self.store.finish, job, self.owner):
+                print(f"Warning: job {job['id']} was reclaimed after its lease "
+                      f"expired; result discarded")
+            await asyncio.to_thread(self.store.purge)
+        except Exception:
+            # the worker must survive a locked / failing store
+            traceback.print_exc()
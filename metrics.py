@@ -0,0 +1,266 @@
+import threading
+
+
+# =========================================================
+# MINIMAL IN-PROCESS METRICS (Prometheus text format)
+# No client library / push gateway: /metrics renders the registry.
+# Each server process keeps its own values.
+# =========================================================
+_registry = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[n]) for n in labelnames)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labelnames, key, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, key)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        _registry.append(self)
+
+    def _samples(self):
+        with self.lock:
+            return [
+                (self.name, _fmt_labels(self.labelnames, key), value)
+                for key, value in sorted(self.values.items())
+            ]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{labels} {_fmt_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        # unlabeled series exist from the start, so rate() sees 0
+        if not self.labelnames:
+            self.values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Set directly, or read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self.function = None
+        if not self.labelnames:
+            self.values[()] = 0
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def set_function(self, fn):
+        self.function = fn
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []
+            return [(self.name, "", value)]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        if not self.labelnames:
+            self.values[()] = {"counts": [0] * len(self.buckets), "sum": 0.0}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+
+    def _samples(self):
+        samples = []
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["counts"]):
+                    cumulative += count
+                    labels = _fmt_labels(self.labelnames, key, [("le", _fmt_value(bound))])
+                    samples.append((f"{self.name}_bucket", labels, cumulative))
+                labels = _fmt_labels(self.labelnames, key)
+                samples.append((f"{self.name}_sum", labels, state["sum"]))
+                samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+def render():
+    """Whole registry in the Prometheus text exposition format"""
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# =========================================================
+# INSPECTION METRICS
+# =========================================================
+STAGE_SECONDS = Histogram(
+    "inspection_stage_seconds",
+    "Wall time per inspection stage",
+    labels=("stage",)
+)
+INSPECTION_SECONDS = Histogram(
+    "inspection_seconds",
+    "End-to-end inspection wall time"
+)
+INSPECTIONS = Counter(
+    "inspections_total",
+    "Completed inspections by engine path (full, fast_path, cached)",
+    labels=("path",)
+)
+INSPECTION_ERRORS = Counter(
+    "inspection_errors_total",
+    "Inspections that raised"
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache and outcome",
+    labels=("cache", "result")
+)
+ALIGNMENT_FAILURES = Counter(
+    "alignment_failures_total",
+    "Full comparisons where alignment_success was false"
+)
+BEDROCK_ERRORS = Counter(
+    "bedrock_errors_total",
+    "Bedrock report calls that raised"
+)
+
+BEDROCK_RETRIES = Counter(
+    "bedrock_retries_total",
+    "Bedrock calls retried after throttling / timeouts"
+)
+
+TOKEN_BUCKETS = (50, 100, 200, 400, 800, 1200, 1600, 2400, 3200, 6400)
+
+LLM_PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Prompt tokens per report call (reported, else estimated)",
+    buckets=TOKEN_BUCKETS
+)
+LLM_RESPONSE_TOKENS = Histogram(
+    "llm_response_tokens",
+    "Response tokens per report call",
+    buckets=TOKEN_BUCKETS
+)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by route and status",
+    labels=("route", "status")
+)
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request wall time by route",
+    labels=("route",)
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled"
+)
+
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth",
+    "Jobs waiting in the inspection queue"
+)
+CV_POOL_SIZE = Gauge(
+    "cv_pool_workers",
+    "OpenCV worker processes"
+)
+CV_POOL_ACTIVE = Gauge(
+    "cv_pool_active_tasks",
+    "Comparisons submitted to the OpenCV pool and not finished"
+)
+CV_POOL_UTILIZATION = Gauge(
+    "cv_pool_utilization",
+    "Busy fraction of the OpenCV pool (0-1)"
+)
+YOLO_QUEUE_DEPTH = Gauge(
+    "yolo_queue_depth",
+    "Images waiting for the YOLO micro-batcher"
+)
+
+
+def observe_inspection(inspection, cached):
+    """Record one finished inspection (stage histograms + counters)"""
+    result = inspection["result"]
+    timings = inspection.get("timings") or {}
+
+    for stage, t in timings.items():
+        STAGE_SECONDS.observe(t["wall_ms"] / 1000.0, stage=stage)
+
+    if cached:
+        INSPECTIONS.inc(path="cached")
+    elif result.get("fast_path"):
+        INSPECTIONS.inc(path="fast_path")
+    else:
+        INSPECTIONS.inc(path="full")
+        if not result.get("alignment_success", True):
+            ALIGNMENT_FAILURES.inc()
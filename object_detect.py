@@ -1,6 +1,16 @@
-from ultralytics import YOLO
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
-model = YOLO("yolov8n.pt")
+import cv2
+import numpy as np
+
+MODEL_PATH = os.getenv("YOLO_MODEL", "yolov8n.pt")
+
+_model = None
+_model_lock = threading.Lock()
 
 DOMAIN_MAP = {
     "car": "machine_part",
@@ -10,31 +20,210 @@ DOMAIN_MAP = {
     "chair": "machine_part"
 }
 
+CONF_THRESHOLD = 0.6
+
+# micro-batching: how long to wait for more requests, and batch cap
+BATCH_WINDOW_MS = float(os.getenv("YOLO_BATCH_WINDOW_MS", 10))
+MAX_BATCH = int(os.getenv("YOLO_MAX_BATCH", 8))
+
+
+# =========================================================
+# MODEL (lazy singleton)
+# =========================================================
+def get_model():
+    """Load YOLO on first use; importing this module stays cheap"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from ultralytics import YOLO
+                _model = YOLO(MODEL_PATH)
+    return _model
+
+
+def preload():
+    """
+    Load the weights in the parent before workers fork
+    (gunicorn --preload) so children share them copy-on-write.
+    """
+    import gc
+
+    get_model()
+    # keep the GC from touching (and copying) the preloaded pages
+    gc.collect()
+    gc.freeze()
+
+
+def warmup(size=640):
+    """One dummy inference so the first request does not pay allocation"""
+    dummy = np.zeros((size, size, 3), dtype=np.uint8)
+    get_model()(dummy, verbose=False)
+
 
 def normalize_label(label):
     return DOMAIN_MAP.get(label, label)
 
 
-def detect_objects(image_path):
-
-    results = model(image_path)
+def _labels_from_result(r, names):
 
     labels = []
 
-    for r in results:
-        for box in r.boxes:
+    for box in r.boxes:
 
-            conf = float(box.conf[0])
+        conf = float(box.conf[0])
 
-            # ✅ confidence filter
-            if conf < 0.6:
-                continue
+        # ✅ confidence filter
+        if conf < CONF_THRESHOLD:
+            continue
 
-            cls_id = int(box.cls[0])
-            name = model.names[cls_id]
+        cls_id = int(box.cls[0])
+        name = names[cls_id]
 
-            name = normalize_label(name)
+        name = normalize_label(name)
 
-            labels.append(name)
+        labels.append(name)
 
     return list(set(labels))
+
+
+def _load(image):
+    """Accept a path or an already decoded BGR array"""
+    if isinstance(image, str):
+        img = cv2.imread(image)
+        if img is None:
+            raise ValueError(f"Image could not be read: {image}")
+        return img
+    return image
+
+
+def detect_objects_batch(images):
+    """Run YOLO over several images in a single forward pass"""
+    if not images:
+        return []
+
+    model = get_model()
+    arrays = [_load(img) for img in images]
+    results = model(arrays, batch=len(arrays))
+
+    return [_labels_from_result(r, model.names) for r in results]
+
+
+def detect_objects(image):
+    """image: path or decoded BGR array"""
+    return detect_objects_batch([image])[0]
+
+
+# =========================================================
+# MICRO-BATCHER
+# Coalesces concurrent detect requests into one batch
+# =========================================================
+class DetectionBatcher:
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._loop, name="yolo-batcher", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, image):
+        """Queue one image, returns a concurrent.futures.Future of labels"""
+        fut = Future()
+        self.requests.put((image, fut))
+        return fut
+
+    def stop(self):
+        self.requests.put(None)
+
+    def _collect(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            batch = [(img, fut) for img, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            # a bad image fails only its own request, not the whole batch
+            loaded = []
+            for img, fut in batch:
+                try:
+                    loaded.append((_load(img), fut))
+                except Exception as e:
+                    fut.set_exception(e)
+            if not loaded:
+                continue
+
+            try:
+                labels = detect_objects_batch([img for img, _ in loaded])
+            except Exception as e:
+                for _, fut in loaded:
+                    fut.set_exception(e)
+                continue
+
+            for (_, fut), lab in zip(loaded, labels):
+                fut.set_result(lab)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = DetectionBatcher()
+    return _batcher
+
+
+def batcher_depth():
+    """Images queued for the batcher (0 when it is not running)"""
+    batcher = _batcher
+    return batcher.requests.qsize() if batcher is not None else 0
+
+
+def stop_batcher():
+    global _batcher
+    with _batcher_lock:
+        if _batcher is not None:
+            _batcher.stop()
+            _batcher = None
+
+
+def _reset_after_fork():
+    # threads do not survive fork, the child starts its own batcher;
+    # the (preloaded) model itself is kept and shared copy-on-write
+    global _batcher, _batcher_lock, _model_lock
+    _batcher = None
+    _batcher_lock = threading.Lock()
+    _model_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,531 @@
+import asyncio
+import functools
+import hashlib
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from caching import (
+    DiskCache, ResultCache, get_result_cache, get_feature_cache, file_hash
+)
+from bedrock_report import (
+    generate_bedrock_report, generate_report_async, stream_report_async,
+    get_client, shutdown_executor
+)
+from image_diff import (
+    compare_images, compare_image_arrays, init_worker, engine_params, normalize_pair,
+    decode_image
+)
+import object_detect
+from object_detect import get_batcher, stop_batcher
+from object_compare import compare_objects
+from comparison_builder import build_comparison_json
+from timing import StageTimer, profiled_call
+import metrics
+
+
+# =========================================================
+# CONFIG
+# =========================================================
+# "concurrent" overlaps the stages on dedicated executors,
+# "serial" runs them one after another (original behaviour)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "concurrent")
+
+# OpenCV work is CPU bound -> process pool
+CV_WORKERS = int(os.getenv("CV_WORKERS", os.cpu_count() or 1))
+
+# report used when the engine's fast path found no meaningful change
+NO_CHANGE_REPORT = (
+    "No significant change detected between the before and after images. "
+    "Condition: Stable. Risk level: Low. "
+    "Recommendation: continue the routine inspection schedule."
+)
+
+_cv_pool = None
+
+
+# =========================================================
+# EXECUTORS (created lazily, one set per worker process)
+# =========================================================
+def get_cv_pool():
+    global _cv_pool
+    if _cv_pool is None:
+        # spawn keeps torch / YOLO state out of the OpenCV workers
+        _cv_pool = ProcessPoolExecutor(
+            max_workers=CV_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker
+        )
+    return _cv_pool
+
+
+def _pool_utilization():
+    if PIPELINE_MODE == "serial" or not CV_WORKERS:
+        return 0
+    return min(metrics.CV_POOL_ACTIVE.get(), CV_WORKERS) / CV_WORKERS
+
+
+metrics.CV_POOL_SIZE.set_function(lambda: 0 if PIPELINE_MODE == "serial" else CV_WORKERS)
+metrics.CV_POOL_UTILIZATION.set_function(_pool_utilization)
+metrics.YOLO_QUEUE_DEPTH.set_function(object_detect.batcher_depth)
+
+
+def shutdown_pools():
+    global _cv_pool
+    if _cv_pool is not None:
+        _cv_pool.shutdown(wait=False, cancel_futures=True)
+        _cv_pool = None
+    stop_batcher()
+    shutdown_executor()
+
+
+# =========================================================
+# STARTUP
+# =========================================================
+def preload_models():
+    """Import-time load for preforked servers (shared copy-on-write)"""
+    object_detect.preload()
+
+
+async def warmup():
+    """
+    Run at startup so the first request does not pay cold-start:
+    YOLO weights + dummy inference, Bedrock client, OpenCV workers.
+    """
+    await asyncio.to_thread(object_detect.warmup)
+    await asyncio.to_thread(get_client)
+
+    if PIPELINE_MODE != "serial":
+        pool = get_cv_pool()
+        await asyncio.gather(*[
+            asyncio.get_running_loop().run_in_executor(pool, init_worker)
+            for _ in range(CV_WORKERS)
+        ])
+
+
+# =========================================================
+# PIPELINE
+# =========================================================
+def _report(comparison_json, result):
+    # unchanged equipment does not need an LLM call
+    if result.get("fast_path"):
+        return NO_CHANGE_REPORT
+    try:
+        return generate_bedrock_report(comparison_json)
+    except Exception:
+        metrics.BEDROCK_ERRORS.inc()
+        raise
+
+
+async def _report_async(comparison_json, result):
+    if result.get("fast_path"):
+        return NO_CHANGE_REPORT
+    try:
+        return await generate_report_async(comparison_json)
+    except Exception:
+        metrics.BEDROCK_ERRORS.inc()
+        raise
+
+
+def _cacheable(result):
+    # timings describe one run, not the pair
+    return {k: v for k, v in result.items() if k != "timings"}
+
+
+def _with_timings(result, timer):
+    """Engine stages (fresh results only) + pipeline stages"""
+    timer.merge(result.get("timings"))
+    return dict(result, timings=timer.to_dict())
+
+
+def _finish(result, before_objs, after_objs):
+    added, removed = compare_objects(before_objs, after_objs)
+
+    comparison_json = build_comparison_json(
+        result,
+        before_objs,
+        after_objs,
+        added,
+        removed
+    )
+
+    return {
+        "result": result,
+        "before_objs": before_objs,
+        "after_objs": after_objs,
+        "added": added,
+        "removed": removed,
+        "comparison_json": comparison_json,
+    }
+
+
+def _compare_fn(image):
+    # paths are read by the engine, decoded arrays go straight in
+    return compare_images if isinstance(image, str) else compare_image_arrays
+
+
+def result_cache_key(before_digest, after_digest):
+    """Cache key for a pair given the sha256 of each image's bytes"""
+    return ResultCache.key(before_digest, after_digest, engine_params())
+
+
+class UnreadableImage(ValueError):
+    """An uploaded image could not be decoded"""
+
+
+def _digests(before, after, digests):
+    # arrays have no stable encoded bytes; callers pass digests for those
+    if digests is None and isinstance(before, str) and isinstance(after, str):
+        digests = (file_hash(before), file_hash(after))
+    elif digests is None and isinstance(before, bytes) and isinstance(after, bytes):
+        digests = (hashlib.sha256(before).hexdigest(), hashlib.sha256(after).hexdigest())
+    return digests
+
+
+def _decode(image, timer, stage):
+    """
+    Raw upload bytes -> BGR array; paths and arrays pass through.
+    Called only when a stage actually needs the pixels, so a fully
+    cached repeat pair is never decoded.
+    """
+    if not isinstance(image, (bytes, bytearray)):
+        return image
+    img = timer.call(stage, decode_image, image)
+    if img is None:
+        raise UnreadableImage("One of the images could not be read")
+    return img
+
+
+def _count_lookup(cache, hit):
+    metrics.CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _objects_key(digest):
+    return get_feature_cache().key(
+        digest, "objects",
+        [object_detect.MODEL_PATH, object_detect.CONF_THRESHOLD]
+    )
+
+
+def cached_objects(digest):
+    if digest is None:
+        return None
+    objs = get_feature_cache().get(_objects_key(digest))
+    _count_lookup("objects", objs is not None)
+    return objs
+
+
+def store_objects(digest, objs):
+    if digest is not None:
+        get_feature_cache().put(_objects_key(digest), objs)
+
+
+def run_inspection_serial(before, after, out_path, digests=None,
+                          homography_key=None, timer=None, report=True):
+    """Run every stage in the calling thread (blocking)."""
+    timer = timer or StageTimer()
+    digests = _digests(before, after, digests)
+    before_digest, after_digest = digests if digests else (None, None)
+
+    cache = get_result_cache()
+    cache_key = result_cache_key(*digests) if digests else None
+
+    result = cache.get(cache_key) if cache_key else None
+    cached = result is not None
+    if cache_key:
+        _count_lookup("result", cached)
+
+    # detections are reused per image (baselines, repeat pairs)
+    before_objs = cached_objects(before_digest)
+    after_objs = cached_objects(after_digest)
+
+    if result is None or before_objs is None or after_objs is None:
+        before = _decode(before, timer, "decode_before")
+        after = _decode(after, timer, "decode_after")
+
+    if result is None:
+        with timer.stage("compare"):
+            result = profiled_call(
+                "compare", _compare_fn(before), before, after, out_path,
+                before_digest=before_digest, homography_key=homography_key
+            )
+        if cache_key:
+            cache.put(cache_key, _cacheable(result))
+
+    # several serial inspections run at once (to_thread): YOLO is only
+    # ever called from the batcher thread, which also batches the pair
+    with timer.stage("yolo"):
+        before_fut = get_batcher().submit(before) if before_objs is None else None
+        after_fut = get_batcher().submit(after) if after_objs is None else None
+        if before_fut is not None:
+            before_objs = before_fut.result()
+            store_objects(before_digest, before_objs)
+        if after_fut is not None:
+            after_objs = after_fut.result()
+            store_objects(after_digest, after_objs)
+
+    inspection = _finish(result, before_objs, after_objs)
+    inspection["bedrock_report"] = None
+    if report or result.get("fast_path"):
+        with timer.stage("report"):
+            inspection["bedrock_report"] = _report(inspection["comparison_json"], result)
+
+    inspection["result"] = _with_timings(result, timer)
+    inspection["timings"] = inspection["result"]["timings"]
+    inspection["cached"] = cached
+    return inspection
+
+
+async def run_inspection(before, after, out_path, digests=None,
+                         homography_key=None, timer=None, report=True):
+    """
+    Run one before/after inspection without blocking the event loop.
+    before / after are file paths, raw upload bytes (decoded only if
+    some stage misses its cache; UnreadableImage if they do not decode)
+    or already decoded BGR arrays;
+    digests = (sha256 of before bytes, sha256 of after bytes) enables
+    the result / feature caches for arrays (paths / bytes are hashed here);
+    homography_key ("<asset>:<camera position>") reuses alignment.
+
+    - compare_images in the OpenCV process pool
+    - both YOLO detections through the micro-batcher thread
+    - Bedrock report through the async, rate-limited report layer
+    Comparison and detection overlap; the report needs both.
+    Per-stage wall / CPU times end up in inspection["timings"]
+    (pass a StageTimer to include stages the caller already ran).
+    report=False skips the Bedrock call (bedrock_report stays None
+    unless the fast path answered); see defer_report.
+    """
+    start = time.perf_counter()
+    try:
+        if PIPELINE_MODE == "serial":
+            inspection = await asyncio.to_thread(
+                run_inspection_serial, before, after, out_path, digests,
+                homography_key, timer, report
+            )
+        else:
+            inspection = await _run_concurrent(
+                before, after, out_path, digests, homography_key, timer, report
+            )
+    except Exception:
+        metrics.INSPECTION_ERRORS.inc()
+        raise
+
+    metrics.INSPECTION_SECONDS.observe(time.perf_counter() - start)
+    metrics.observe_inspection(inspection, inspection["cached"])
+    return inspection
+
+
+async def _run_concurrent(before, after, out_path, digests, homography_key,
+                          timer, report):
+    loop = asyncio.get_running_loop()
+    timer = timer or StageTimer()
+
+    digests = await asyncio.to_thread(_digests, before, after, digests)
+    before_digest, after_digest = digests if digests else (None, None)
+    cache_key = result_cache_key(*digests) if digests else None
+
+    cache = get_result_cache()
+    cached = None
+    if cache_key is not None:
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        _count_lookup("result", cached is not None)
+
+    # detections are reused per image (baselines, repeat pairs)
+    cached_before_objs = await asyncio.to_thread(cached_objects, before_digest)
+    cached_after_objs = await asyncio.to_thread(cached_objects, after_digest)
+
+    # a fully cached repeat pair never decodes its uploads
+    if cached is None or cached_before_objs is None or cached_after_objs is None:
+        before, after = await asyncio.gather(
+            asyncio.to_thread(_decode, before, timer, "decode_before"),
+            asyncio.to_thread(_decode, after, timer, "decode_after")
+        )
+
+    if cached is not None:
+        # repeat analysis: no OpenCV work at all
+        compare_task = loop.create_future()
+        compare_task.set_result(cached)
+    else:
+        engine_before, engine_after = before, after
+        if not isinstance(before, str):
+            # ship working-size arrays to the pool, not full decodes
+            engine_before, engine_after = await asyncio.to_thread(
+                timer.call, "resize_for_pool", normalize_pair, before, after
+            )
+        compare_task = loop.run_in_executor(
+            get_cv_pool(),
+            functools.partial(
+                profiled_call, "compare", _compare_fn(before),
+                engine_before, engine_after, out_path,
+                before_digest=before_digest, homography_key=homography_key
+            )
+        )
+        metrics.CV_POOL_ACTIVE.inc()
+        compare_task.add_done_callback(lambda _: metrics.CV_POOL_ACTIVE.dec())
+
+    # the batcher coalesces these with other in-flight requests
+    if cached_before_objs is not None:
+        before_task = loop.create_future()
+        before_task.set_result(cached_before_objs)
+    else:
+        before_task = asyncio.wrap_future(get_batcher().submit(before))
+    if cached_after_objs is not None:
+        after_task = loop.create_future()
+        after_task.set_result(cached_after_objs)
+    else:
+        after_task = asyncio.wrap_future(get_batcher().submit(after))
+
+    result, (before_objs, after_objs) = await asyncio.gather(
+        timer.wait("compare", compare_task),
+        timer.wait("yolo", asyncio.gather(before_task, after_task))
+    )
+
+    if cached is None and cache_key is not None:
+        await asyncio.to_thread(cache.put, cache_key, _cacheable(result))
+    if cached_before_objs is None:
+        await asyncio.to_thread(store_objects, before_digest, before_objs)
+    if cached_after_objs is None:
+        await asyncio.to_thread(store_objects, after_digest, after_objs)
+
+    inspection = _finish(result, before_objs, after_objs)
+    inspection["bedrock_report"] = None
+    if report or result.get("fast_path"):
+        inspection["bedrock_report"] = await timer.wait(
+            "report", _report_async(inspection["comparison_json"], result)
+        )
+
+    inspection["result"] = _with_timings(result, timer)
+    inspection["timings"] = inspection["result"]["timings"]
+    inspection["cached"] = cached is not None
+    return inspection
+
+
+# =========================================================
+# STREAMED REPORTS
+# the page renders with the CV results; the report follows over SSE
+# =========================================================
+REPORT_STREAM_TTL = float(os.getenv("REPORT_STREAM_TTL", 600))
+# on disk so the stream request may land on any server worker
+REPORT_STREAM_DIR = os.getenv("REPORT_STREAM_DIR", "cache/pending_reports")
+REPORT_STREAM_MAX_MB = float(os.getenv("REPORT_STREAM_MAX_MB", 32))
+
+_pending_reports = None
+
+
+def _get_pending_reports():
+    global _pending_reports
+    if _pending_reports is None:
+        _pending_reports = DiskCache(REPORT_STREAM_DIR, REPORT_STREAM_MAX_MB * 1024 * 1024)
+    return _pending_reports
+
+
+async def defer_report(inspection):
+    """
+    Park what the report needs and return the stream URL
+    (None when the report is already there, e.g. fast path).
+    """
+    if inspection["bedrock_report"] is not None:
+        return None
+
+    report_id = uuid.uuid4().hex
+    await asyncio.to_thread(_get_pending_reports().put, report_id, {
+        "comparison_json": inspection["comparison_json"],
+        "created_at": time.time(),
+    })
+    inspection["report_stream_url"] = f"/reports/{report_id}/stream"
+    return inspection["report_stream_url"]
+
+
+def _valid_report_id(report_id):
+    # ids are uuid4 hex; anything else never names a file
+    return len(report_id) == 32 and all(c in "0123456789abcdef" for c in report_id)
+
+
+def pending_report(report_id):
+    """comparison_json of a deferred report, None if unknown / expired"""
+    if not _valid_report_id(report_id):
+        return None
+
+    entry = _get_pending_reports().get(report_id)
+    if entry is None:
+        return None
+    if time.time() - entry["created_at"] > REPORT_STREAM_TTL:
+        _get_pending_reports().delete(report_id)
+        return None
+    return entry["comparison_json"]
+
+
+def finish_report(report_id):
+    """Drop a parked report once it has been streamed (and cached)"""
+    if _valid_report_id(report_id):
+        _get_pending_reports().delete(report_id)
+
+
+async def stream_report(comparison_json):
+    """Report text pieces as they arrive from Bedrock"""
+    try:
+        async for text in stream_report_async(comparison_json):
+            yield text
+    except Exception:
+        metrics.BEDROCK_ERRORS.inc()
+        raise
+
+
+# =========================================================
+# RESULT PAYLOAD (what result.html is rendered from)
+# =========================================================
+# static mounts of app.py: (directory, URL prefix); paths outside
+# them are served relative to the working directory
+_static_mounts = []
+
+
+def register_static(directory, prefix):
+    _static_mounts.append((os.path.abspath(directory), prefix.rstrip("/")))
+
+
+def _url(path):
+    if not path:
+        return None
+    full = os.path.abspath(path)
+    for directory, prefix in _static_mounts:
+        if full.startswith(directory + os.sep):
+            return prefix + "/" + os.path.relpath(full, directory).replace(os.sep, "/")
+    return "/" + path
+
+
+def build_result_payload(inspection, before_path, after_path, out_path):
+    result = inspection["result"]
+
+    return {
+        # core metrics
+        "metrics": result,
+
+        # structured comparison (for AI / logs / export)
+        "comparison_json": inspection["comparison_json"],
+
+        # objects
+        "before_objs": inspection["before_objs"],
+        "after_objs": inspection["after_objs"],
+        "added": inspection["added"],
+        "removed": inspection["removed"],
+
+        # originals for slider
+        "before_original": _url(before_path),
+        "after_original": _url(after_path),
+
+        # AI report (or the SSE endpoint it will arrive on)
+        "bedrock_report": inspection["bedrock_report"],
+        "report_stream_url": inspection.get("report_stream_url"),
+
+        # images
+        "output_image": _url(result.get("annotated_path", out_path)),
+        "heatmap_image": _url(result["heatmap_path"]),
+        "before_heatmap_image": _url(result["before_heatmap_path"]),
+
+        # interactive zones
+        "zone_boxes": result.get("zone_boxes", {}),
+        "zone_severity": result.get("zone_severity", {}),
+    }
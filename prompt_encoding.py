@@ -0,0 +1,175 @@
+import json
+import math
+import os
+import re
+import time
+
+import metrics
+
+
+# =========================================================
+# CONFIG
+# =========================================================
+# "compact" (default) or "full" (indent=2, every zone: the original prompt)
+PROMPT_FORMAT = os.getenv("PROMPT_FORMAT", "compact")
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1200))
+PROMPT_MAX_ZONES = int(os.getenv("PROMPT_MAX_ZONES", 6))
+PROMPT_FLOAT_DIGITS = int(os.getenv("PROMPT_FLOAT_DIGITS", 2))
+
+# PROMPT_MEASURE=1 appends one JSON line per report call
+PROMPT_MEASURE = os.getenv("PROMPT_MEASURE", "0") == "1"
+PROMPT_MEASURE_FILE = os.getenv("PROMPT_MEASURE_FILE", "logs/prompt_tokens.jsonl")
+
+
+def settings():
+    """Everything that changes the encoded prompt (part of cache keys)"""
+    return {
+        "format": PROMPT_FORMAT,
+        "budget": PROMPT_TOKEN_BUDGET,
+        "max_zones": PROMPT_MAX_ZONES,
+        "digits": PROMPT_FLOAT_DIGITS,
+    }
+
+
+# =========================================================
+# TOKEN ESTIMATE
+# Word pieces + single punctuation marks track BPE counts for
+# JSON-heavy English prompts closely enough for budgeting;
+# the measurement mode records the real counts.
+# =========================================================
+_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text):
+    pieces = _PIECES.findall(text)
+    # long words split into several tokens
+    return sum(max(1, math.ceil(len(p) / 6)) for p in pieces)
+
+
+# =========================================================
+# COMPACT ENCODER
+# =========================================================
+def _round(value, digits):
+    if isinstance(value, float):
+        value = round(value, digits)
+        return int(value) if value == int(value) else value
+    if isinstance(value, dict):
+        return {k: _round(v, digits) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_round(v, digits) for v in value]
+    return value
+
+
+def compact_comparison(comparison_json, max_zones=PROMPT_MAX_ZONES,
+                       digits=PROMPT_FLOAT_DIGITS, with_objects=True):
+    """
+    Smaller equivalent of build_comparison_json's output for the LLM:
+    rounded numbers, no None values, zones ranked by severity (top N,
+    without pixel boxes), object lists deduplicated and sorted.
+    """
+    image_metrics = {
+        k: v for k, v in comparison_json.get("image_metrics", {}).items()
+        if v is not None
+    }
+
+    zones = sorted(
+        comparison_json.get("zones", []),
+        key=lambda z: z.get("severity") or 0,
+        reverse=True
+    )
+
+    data = {
+        "metrics": image_metrics,
+        "zones": [
+            {"zone": z["zone"], "part": z.get("part"), "severity": z.get("severity")}
+            for z in zones[:max_zones]
+        ],
+    }
+    if len(zones) > max_zones:
+        data["zones_omitted"] = len(zones) - max_zones
+
+    objects = comparison_json.get("objects", {})
+    if with_objects:
+        data["objects"] = {
+            k: sorted(set(v)) for k, v in objects.items() if v
+        }
+    else:
+        data["objects"] = {k: len(set(v)) for k, v in objects.items() if v}
+
+    return _round(data, digits)
+
+
+def dumps_compact(data):
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_comparison(comparison_json, render, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Serialize comparison_json for the prompt.
+    render(data_text) -> full prompt; the compact form is shrunk step
+    by step (fewer zones, fewer digits, object counts) until the
+    estimated prompt fits the budget.
+    Returns (prompt, info) with info for the measurement log.
+    """
+    if PROMPT_FORMAT == "full":
+        prompt = render(json.dumps(comparison_json, indent=2))
+        return prompt, {"format": "full", "estimated_tokens": estimate_tokens(prompt)}
+
+    total_zones = len(comparison_json.get("zones", []))
+    steps = []
+    zones = min(PROMPT_MAX_ZONES, total_zones)
+    while True:
+        steps.append((zones, PROMPT_FLOAT_DIGITS, True))
+        if zones == 0:
+            break
+        zones //= 2
+    steps += [(0, 1, True), (0, 1, False)]
+
+    for max_zones, digits, with_objects in steps:
+        data = compact_comparison(comparison_json, max_zones, digits, with_objects)
+        prompt = render(dumps_compact(data))
+        estimated = estimate_tokens(prompt)
+        if estimated <= budget:
+            break
+
+    return prompt, {
+        "format": "compact",
+        "estimated_tokens": estimated,
+        "zones_sent": len(data["zones"]),
+        "zones_total": total_zones,
+        "over_budget": estimated > budget,
+    }
+
+
+# =========================================================
+# MEASUREMENT
+# =========================================================
+def record_usage(info, usage, elapsed_s=None):
+    """
+    usage: Anthropic "usage" block ({"input_tokens", "output_tokens"}),
+    may be None when the backend does not report it
+    """
+    usage = usage or {}
+    input_tokens = usage.get("input_tokens")
+    output_tokens = usage.get("output_tokens")
+
+    metrics.LLM_PROMPT_TOKENS.observe(
+        input_tokens if input_tokens is not None else info["estimated_tokens"]
+    )
+    if output_tokens is not None:
+        metrics.LLM_RESPONSE_TOKENS.observe(output_tokens)
+
+    if not PROMPT_MEASURE:
+        return
+
+    record = dict(info)
+    record.update({
+        "ts": time.time(),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "elapsed_s": None if elapsed_s is None else round(elapsed_s, 3),
+    })
+
+    os.makedirs(os.path.dirname(PROMPT_MEASURE_FILE) or ".", exist_ok=True)
+    with open(PROMPT_MEASURE_FILE, "a") as f:
+        f.write(json.dumps(record) + "\n")
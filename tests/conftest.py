@@ -0,0 +1,29 @@
+import os
+import sys
+
+# tests import the top-level modules the way app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import bedrock_report
+
+
+@pytest.fixture
+def stub(monkeypatch, tmp_path):
+    """Fresh report cache + stub client, no backoff sleeps"""
+    monkeypatch.setattr(bedrock_report, "BEDROCK_BACKOFF_BASE", 0)
+    monkeypatch.setattr(
+        bedrock_report, "_report_cache",
+        bedrock_report.ReportCache(directory=str(tmp_path / "reports"))
+    )
+    # the semaphore belongs to the event loop of the previous test
+    monkeypatch.setattr(bedrock_report, "_semaphore", None)
+
+    def make(**kwargs):
+        client = bedrock_report.StubBedrockClient(**kwargs)
+        bedrock_report.set_client(client)
+        return client
+
+    yield make
+    bedrock_report.set_client(None)
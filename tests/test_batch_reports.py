@@ -0,0 +1,64 @@
+import bedrock_report
+from bedrock_report import _parse_batch_reply
+from test_report_cache import comparison
+
+
+def test_parse_reply_with_surrounding_text():
+    text = 'Here you go:\n```json\n{"reports": [{"id": "i0", "report": " ok "}]}\n```'
+    assert _parse_batch_reply(text, {"i0", "i1"}) == {"i0": "ok"}
+
+
+def test_parse_reply_drops_bad_entries():
+    text = ('{"reports": [{"id": "i0", "report": ""}, {"id": "zz", "report": "x"},'
+            ' "junk", {"id": "i1", "report": 3}, {"id": "i2", "report": "fine"}]}')
+    assert _parse_batch_reply(text, {"i0", "i1", "i2"}) == {"i2": "fine"}
+
+
+def test_parse_reply_not_json():
+    assert _parse_batch_reply("Sorry, I cannot help with that.", {"i0"}) == {}
+    assert _parse_batch_reply("{not json}", {"i0"}) == {}
+
+
+def test_batch_packs_requests_and_falls_back_per_item(stub):
+    # the stub leaves the first id of every batch out of its reply
+    client = stub(batch_drop=1)
+    comparisons = [comparison(change=float(i)) for i in range(6)]
+
+    results = bedrock_report.generate_bedrock_reports_batch(comparisons, batch_size=3)
+
+    assert [r["source"] for r in results] == ["single", "batch", "batch"] * 2
+    assert all(r["report"] == "Stub inspection report." for r in results)
+    # 2 packed requests + 2 single fallbacks
+    assert len(client.calls) == 4
+
+    again = bedrock_report.generate_bedrock_reports_batch(comparisons, batch_size=3)
+    assert {r["source"] for r in again} == {"cache"}
+    assert len(client.calls) == 4
+
+
+def test_batch_reports_are_not_served_as_single_reports(stub):
+    client = stub()
+    comparisons = [comparison(change=1.0), comparison(change=2.0)]
+
+    results = bedrock_report.generate_bedrock_reports_batch(comparisons)
+    assert [r["source"] for r in results] == ["batch", "batch"]
+    assert len(client.calls) == 1
+
+    # the single-report path uses its own prompt, so it calls again...
+    bedrock_report.generate_bedrock_report(comparisons[0])
+    assert len(client.calls) == 2
+
+    # ...while a batch run reuses that single report
+    again = bedrock_report.generate_bedrock_reports_batch(comparisons)
+    assert [r["source"] for r in again] == ["cache", "cache"]
+    assert len(client.calls) == 2
+
+
+def test_batch_failures_are_reported_per_item(stub, monkeypatch):
+    monkeypatch.setattr(bedrock_report, "BEDROCK_MAX_ATTEMPTS", 1)
+    stub(fail_times=100)
+
+    results = bedrock_report.generate_bedrock_reports_batch([comparison(), comparison(2.0)])
+
+    assert [r["source"] for r in results] == ["failed", "failed"]
+    assert all(r["report"] is None and "ThrottlingException" in r["error"] for r in results)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+
+import pytest
+
+import bedrock_report
+from bedrock_report import StubBedrockClient, StubClientError
+from test_report_cache import comparison
+
+
+class MidStreamFailure(StubBedrockClient):
+    """Streams the first word, then the connection drops"""
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        self._call(modelId, body)
+
+        def events():
+            delta = {"type": "content_block_delta", "index": 0,
+                     "delta": {"type": "text_delta", "text": "Partial"}}
+            yield {"chunk": {"bytes": json.dumps(delta).encode()}}
+            raise StubClientError("ThrottlingException")
+
+        return {"body": events()}
+
+
+async def collect(comparison_json):
+    return [text async for text in bedrock_report.stream_report_async(comparison_json)]
+
+
+def test_backoff_is_full_jitter_and_capped(monkeypatch):
+    monkeypatch.setattr(bedrock_report, "BEDROCK_BACKOFF_BASE", 0.5)
+    monkeypatch.setattr(bedrock_report, "BEDROCK_BACKOFF_MAX", 2)
+
+    delays = [bedrock_report._backoff(attempt) for attempt in range(10) for _ in range(50)]
+    assert all(0 <= d <= 2 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_throttling_is_retried(stub):
+    client = stub(fail_times=2)
+
+    assert bedrock_report.generate_bedrock_report(comparison()) == "Stub inspection report."
+    assert len(client.calls) == 3
+
+
+def test_other_errors_are_not_retried(stub):
+    client = stub(fail_times=5, error_code="AccessDeniedException")
+
+    with pytest.raises(StubClientError):
+        bedrock_report.generate_bedrock_report(comparison())
+    assert len(client.calls) == 1
+
+
+def test_retries_give_up_after_max_attempts(stub, monkeypatch):
+    monkeypatch.setattr(bedrock_report, "BEDROCK_MAX_ATTEMPTS", 3)
+    client = stub(fail_times=10)
+
+    with pytest.raises(StubClientError):
+        asyncio.run(bedrock_report.generate_report_async(comparison()))
+    assert len(client.calls) == 3
+
+
+def test_async_callers_coalesce(stub):
+    client = stub(delay=0.1, fail_times=1)
+
+    async def main():
+        return await asyncio.gather(*[
+            bedrock_report.generate_report_async(comparison()) for _ in range(5)
+        ])
+
+    assert asyncio.run(main()) == ["Stub inspection report."] * 5
+    # one failed attempt + one retry, shared by all five callers
+    assert len(client.calls) == 2
+
+
+def test_call_timeout(stub, monkeypatch):
+    monkeypatch.setattr(bedrock_report, "BEDROCK_CALL_TIMEOUT", 0.05)
+    monkeypatch.setattr(bedrock_report, "BEDROCK_MAX_ATTEMPTS", 2)
+    client = stub(delay=0.3)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(bedrock_report.generate_report_async(comparison()))
+    assert len(client.calls) == 2
+
+
+def test_stream_retries_before_first_delta(stub):
+    client = stub(text="Rust increased in zone Z1", fail_times=1)
+
+    chunks = asyncio.run(collect(comparison()))
+    assert "".join(chunks) == "Rust increased in zone Z1"
+    assert len(chunks) == 5
+    assert len(client.calls) == 2
+
+    # the streamed text is cached for the next request
+    assert asyncio.run(collect(comparison())) == ["Rust increased in zone Z1"]
+    assert len(client.calls) == 2
+
+
+def test_stream_is_not_restarted_after_first_delta(stub):
+    client = MidStreamFailure()
+    bedrock_report.set_client(client)
+    received = []
+
+    async def main():
+        async for text in bedrock_report.stream_report_async(comparison()):
+            received.append(text)
+
+    with pytest.raises(StubClientError):
+        asyncio.run(main())
+    assert received == ["Partial"]
+    assert len(client.calls) == 1
+
+
+def test_concurrent_streams_share_one_call(stub):
+    client = stub(text="Rust increased in zone Z1", delay=0.2)
+
+    async def main():
+        return await asyncio.gather(
+            collect(comparison()),
+            collect(comparison()),
+            bedrock_report.generate_report_async(comparison()),
+        )
+
+    first, second, report = asyncio.run(main())
+    assert "".join(first) == "Rust increased in zone Z1"
+    assert second == ["Rust increased in zone Z1"]
+    assert report == "Rust increased in zone Z1"
+    assert len(client.calls) == 1
+
+
+def test_slow_stream_consumer_does_not_hold_a_slot(stub, monkeypatch):
+    monkeypatch.setattr(bedrock_report, "BEDROCK_MAX_CONCURRENCY", 1)
+    client = stub(text="one two three")
+
+    async def main():
+        stream = bedrock_report.stream_report_async(comparison())
+        first = await stream.__anext__()
+        # the first stream is paused mid-report; another call still runs
+        other = await asyncio.wait_for(
+            bedrock_report.generate_report_async(comparison(change=1.0)), timeout=2
+        )
+        rest = [text async for text in stream]
+        return first, other, rest
+
+    first, other, rest = asyncio.run(main())
+    assert first + "".join(rest) == "one two three"
+    assert other == "one two three"
+    assert len(client.calls) == 2
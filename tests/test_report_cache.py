@@ -0,0 +1,68 @@
+import threading
+
+import bedrock_report
+
+
+def comparison(change=12.5, objects=("pipe", "valve")):
+    return {
+        "image_metrics": {"similarity": 0.91, "change_percent": change},
+        "zones": [{"zone": "Z1", "severity": 0.4, "part": "flange", "box": [0, 0, 10, 10]}],
+        "objects": {"before": list(objects), "after": [], "added": [], "removed": []},
+    }
+
+
+def test_stub_report_is_cached(stub):
+    client = stub(text="Rust increased in Z1.")
+
+    assert bedrock_report.generate_bedrock_report(comparison()) == "Rust increased in Z1."
+    assert bedrock_report.generate_bedrock_report(comparison()) == "Rust increased in Z1."
+    assert len(client.calls) == 1
+
+
+def test_cache_survives_a_new_process_cache(stub, tmp_path):
+    client = stub()
+    bedrock_report.generate_bedrock_report(comparison())
+
+    # a second worker / restart: empty memory, same directory
+    bedrock_report._report_cache = bedrock_report.ReportCache(
+        directory=str(tmp_path / "reports")
+    )
+    bedrock_report.generate_bedrock_report(comparison(objects=("valve", "pipe")))
+    assert len(client.calls) == 1
+
+
+def test_key_ignores_object_order():
+    key = bedrock_report.ReportCache.key
+    assert key(comparison(objects=("pipe", "valve"))) == key(comparison(objects=("valve", "pipe")))
+    assert key(comparison(change=1.0)) != key(comparison(change=2.0))
+
+
+def test_concurrent_callers_share_one_call(stub):
+    client = stub(delay=0.2)
+    results = []
+
+    def worker():
+        results.append(bedrock_report.generate_bedrock_report(comparison()))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == ["Stub inspection report."] * 8
+    assert len(client.calls) == 1
+
+
+def test_errors_are_not_cached(stub):
+    client = stub(fail_times=1, error_code="ValidationException")
+
+    try:
+        bedrock_report.generate_bedrock_report(comparison())
+    except bedrock_report.StubClientError:
+        pass
+    else:
+        raise AssertionError("expected the stub error")
+
+    assert bedrock_report.generate_bedrock_report(comparison()) == "Stub inspection report."
+    assert len(client.calls) == 2
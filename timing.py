@@ -0,0 +1,184 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+# =========================================================
+# CONFIG
+# =========================================================
+# dump a sampled profile for requests / comparisons slower than this
+# (0 disables the profiler entirely)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+
+# =========================================================
+# PER-STAGE TIMER
+# wall time + CPU time of the thread that ran the stage
+# =========================================================
+class StageTimer:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.mark()
+
+    def add(self, name, wall_ms, cpu_ms=None, accumulate=False):
+        with self.lock:
+            prev = self.stages.get(name) if accumulate else None
+            if prev is not None:
+                wall_ms += prev["wall_ms"]
+                if cpu_ms is not None and prev["cpu_ms"] is not None:
+                    cpu_ms += prev["cpu_ms"]
+            self.stages[name] = {
+                "wall_ms": round(wall_ms, 3),
+                "cpu_ms": None if cpu_ms is None else round(cpu_ms, 3),
+            }
+
+    def mark(self):
+        self.last = (time.perf_counter(), time.thread_time())
+
+    def lap(self, name):
+        """
+        Close a stage that started at the previous mark / lap
+        (for sequential code; a repeated name accumulates)
+        """
+        wall, cpu = time.perf_counter(), time.thread_time()
+        self.add(
+            name,
+            (wall - self.last[0]) * 1000,
+            (cpu - self.last[1]) * 1000,
+            accumulate=True
+        )
+        self.last = (wall, cpu)
+
+    def merge(self, stages, prefix=""):
+        for name, t in (stages or {}).items():
+            self.add(prefix + name, t["wall_ms"], t["cpu_ms"])
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(
+                name,
+                (time.perf_counter() - wall) * 1000,
+                (time.thread_time() - cpu) * 1000
+            )
+
+    def call(self, name, fn, *args, **kwargs):
+        """Run fn as one stage (handy with asyncio.to_thread)"""
+        with self.stage(name):
+            return fn(*args, **kwargs)
+
+    async def wait(self, name, awaitable):
+        """Wall time of an awaited step (CPU is spent elsewhere)"""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def to_dict(self):
+        with self.lock:
+            return dict(self.stages)
+
+
+def server_timing(stages):
+    """Server-Timing header value: stage;dur=<wall ms>;desc="cpu <ms>" """
+    parts = []
+    for name, t in stages.items():
+        entry = f"{name};dur={t['wall_ms']:.1f}"
+        if t.get("cpu_ms") is not None:
+            entry += f';desc="cpu {t["cpu_ms"]:.1f}ms"'
+        parts.append(entry)
+    return ", ".join(parts)
+
+
+# =========================================================
+# SAMPLING PROFILER (stdlib only, opt-in)
+# Samples every thread's stack; the dump is in collapsed-stack
+# format ("a;b;c <count>"), readable by speedscope / flamegraph.pl
+# =========================================================
+class SamplingProfiler:
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def dump(self, label):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in label)
+        path = os.path.join(
+            PROFILE_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{safe}.collapsed"
+        )
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+@contextmanager
+def profile_if_slow(label, slow_ms=None):
+    """
+    Sample while the block runs; keep the profile only if it took
+    longer than slow_ms (PROFILE_SLOW_MS by default, 0 = disabled)
+    """
+    slow_ms = PROFILE_SLOW_MS if slow_ms is None else slow_ms
+    if not slow_ms:
+        yield
+        return
+
+    profiler = SamplingProfiler().start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        if (time.perf_counter() - start) * 1000 >= slow_ms:
+            profiler.dump(label)
+
+
+def profiled_call(label, fn, *args, **kwargs):
+    """Module level so it can be shipped to a process pool"""
+    with profile_if_slow(label):
+        return fn(*args, **kwargs)